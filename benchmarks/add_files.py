@@ -0,0 +1,92 @@
+#!/bin/env python
+"""Compares adding files one after another with the concurrent `addFiles`.
+
+The storage and the database are stubbed: each upload blocks a storage
+executor thread for `--put-time` seconds, and each database round trip
+sleeps for `--query-time` seconds. The sequential run awaits `add_file` for
+one file at a time, as `addFiles` did before its uploads were made
+concurrent. Run with:
+
+    python -m benchmarks.add_files [--files N] [--put-time SECONDS] [--query-time SECONDS]
+"""
+import argparse
+import asyncio
+import io
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from fileshare.graphql.file import mutations
+from fileshare.graphql.file.mutations import FileMutation, add_file
+from fileshare.settings import settings
+from benchmarks.storage_executor import SleepingStorage
+
+
+class StubUpload:
+
+    """Stands in for strawberry's `Upload`"""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.file = io.BytesIO(b"")
+        self.size = 0
+
+
+class StubSession:
+
+    """An `AsyncSession` whose every round trip just sleeps"""
+
+    def __init__(self, query_time: float) -> None:
+        self._query_time = query_time
+
+    def add(self, instance) -> None:
+        instance.id = uuid.uuid4()
+        instance.created = instance.updated = datetime.now()
+        instance.share_count = instance.download_count = 0
+
+    async def flush(self) -> None:
+        await asyncio.sleep(self._query_time)
+
+    async def refresh(self, instance) -> None:
+        await asyncio.sleep(self._query_time)
+
+    async def commit(self) -> None:
+        await asyncio.sleep(self._query_time)
+
+    async def rollback(self) -> None:
+        await asyncio.sleep(self._query_time)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compares sequential and concurrent file uploads.")
+    parser.add_argument("--files", type=int, default=16, help="number of files uploaded")
+    parser.add_argument("--put-time", type=float, default=0.05, help="seconds each stub upload blocks for")
+    parser.add_argument("--query-time", type=float, default=0.002, help="seconds each stub database round trip takes")
+    args = parser.parse_args()
+
+    @asynccontextmanager
+    async def get_session():
+        yield StubSession(args.query_time)
+
+    storage = SleepingStorage(args.put_time)
+    mutations.storage = storage
+    mutations.get_session = get_session
+    files = [StubUpload(f"file-{i}") for i in range(args.files)]
+
+    start = time.perf_counter()
+    for file in files:
+        await add_file("sequential/" + file.filename, file)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = await FileMutation().add_files(None, "concurrent/", files)
+    concurrent = time.perf_counter() - start
+    assert len(result.added) == args.files, result.errors
+
+    print(f"sequential  {sequential * 1000:8.1f}ms")
+    print(f"concurrent  {concurrent * 1000:8.1f}ms  (GRAPHQL__UPLOAD_CONCURRENCY={settings.graphql.upload_concurrency})")
+    await storage.close()
+
+if __name__=="__main__":
+    asyncio.run(main())
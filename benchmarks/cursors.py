@@ -0,0 +1,57 @@
+#!/bin/env python
+"""Compares the signed binary cursors with the bookmark-string cursors they replaced.
+
+The old cursors were sqlakeyset bookmarks, serialized to text and base64
+encoded. Both formats encode and decode the same keyset places, those of the
+`UPDATED` file sort and the `FILE_NAME` file sort. Run with:
+
+    python -m benchmarks.cursors [--number N]
+"""
+import argparse
+import timeit
+import uuid
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from sqlakeyset import serialize_bookmark, unserialize_bookmark
+
+from fileshare.graphql.cursors import decode_cursor, encode_cursor
+
+SPEC = "file.updated DESC,file.created DESC,file.id DESC"
+
+PLACES = {
+    "updated": (datetime(2023, 7, 28, 1, 2, 3, 456789), datetime(2023, 7, 27, 9, 8, 7, 654321), uuid.uuid4()),
+    "file_name": ("reports/2023/quarterly_report_q2.pdf", datetime(2023, 7, 28, 1, 2, 3, 456789), datetime(2023, 7, 27, 9, 8, 7, 654321), uuid.uuid4()),
+}
+
+
+def old_encode(place: tuple) -> str:
+    return b64encode(serialize_bookmark((place, False)).encode("utf-8")).decode("ascii")
+
+def old_decode(cursor: str) -> tuple:
+    return unserialize_bookmark(b64decode(cursor.encode("ascii")).decode("utf-8")).place
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times encoding and decoding cursors.")
+    parser.add_argument("--number", type=int, default=100000, help="calls timed per measurement")
+    args = parser.parse_args()
+
+    for name, place in PLACES.items():
+        old_cursor = old_encode(place)
+        new_cursor = encode_cursor(place, SPEC)
+        assert old_decode(old_cursor) == place
+        assert decode_cursor(new_cursor, SPEC) == place
+
+        timings = {
+            "old encode": timeit.timeit(lambda: old_encode(place), number=args.number),
+            "new encode": timeit.timeit(lambda: encode_cursor(place, SPEC), number=args.number),
+            "old decode": timeit.timeit(lambda: old_decode(old_cursor), number=args.number),
+            "new decode": timeit.timeit(lambda: decode_cursor(new_cursor, SPEC), number=args.number),
+        }
+        print(f"{name}: old cursor {len(old_cursor)} chars, new cursor {len(new_cursor)} chars")
+        for label, seconds in timings.items():
+            print(f"  {label}  {seconds / args.number * 1e6:7.2f}us")
+
+if __name__=="__main__":
+    main()
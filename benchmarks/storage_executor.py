@@ -0,0 +1,85 @@
+#!/bin/env python
+"""Measures how much blocking storage calls delay the event loop.
+
+A stub storage whose `put` just sleeps stands in for minio. The same batch of
+calls is made twice: inline on the event loop, as the storage did before it
+had an executor, and through `MinioStorage.put`, which runs them on the
+storage executor. Meanwhile a ticker measures how late the loop wakes it up.
+Run with:
+
+    python -m benchmarks.storage_executor [--calls N] [--call-time SECONDS]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from fileshare.settings import settings
+from fileshare.storage.minio import MinioStorage
+
+TICK = 0.001
+
+
+class SleepingStorage(MinioStorage):
+
+    """A MinioStorage whose blocking put sleeps instead of calling minio"""
+
+    def __init__(self, call_time: float) -> None:
+        super().__init__(settings.minio)
+        self._call_time = call_time
+
+    def _put(self, name: str, data, size) -> None:
+        time.sleep(self._call_time)
+
+
+async def ticker(lags: list[float], stop: asyncio.Event) -> None:
+    """Records how late each `TICK` second sleep is woken up"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def measure(calls: int, put) -> tuple[float, list[float]]:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(put(f"object-{i}") for i in range(calls)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick_task
+    return elapsed, lags
+
+
+def report(label: str, elapsed: float, lags: list[float]) -> None:
+    print(
+        f"{label:<10} total {elapsed * 1000:8.1f}ms  "
+        f"loop lag mean {statistics.fmean(lags) * 1000:7.2f}ms  max {max(lags) * 1000:7.2f}ms  "
+        f"({len(lags)} ticks)"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measures event loop lag during blocking storage calls.")
+    parser.add_argument("--calls", type=int, default=32, help="number of concurrent calls")
+    parser.add_argument("--call-time", type=float, default=0.05, help="seconds each stub call blocks for")
+    args = parser.parse_args()
+
+    storage = SleepingStorage(args.call_time)
+
+    async def inline_put(name: str) -> None:
+        storage._put(name, None, 0)
+
+    async def executor_put(name: str) -> None:
+        await storage.put(name, None, 0)
+
+    report("inline", *await measure(args.calls, inline_put))
+    report("executor", *await measure(args.calls, executor_put))
+    await storage.close()
+
+if __name__=="__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, TypeVar
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+ValueType = TypeVar("ValueType")
+
+
+class TTLCache(Generic[KeyType, ValueType]):
+
+    """A bounded, in-process LRU cache whose entries expire.
+
+    Not thread-safe; it is meant to be used from the event loop.
+
+    Attributes:
+        maxsize -- The maximum number of entries kept. The least recently used
+            entry is evicted when a new one would exceed it.
+        ttl -- The default lifetime of an entry in seconds, or None for
+            entries which only leave the cache by eviction.
+        hits -- The number of lookups answered from the cache.
+        misses -- The number of lookups not answered from the cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[KeyType, tuple[float | None, ValueType]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: KeyType) -> ValueType | None:
+        """Returns the live entry for `key`, or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: KeyType, value: ValueType, ttl: float | None = None) -> None:
+        """Stores `value` under `key` for `ttl` seconds (or the default ttl)"""
+        if self.maxsize <= 0:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def items(self) -> list[tuple[KeyType, ValueType]]:
+        """Returns a snapshot of the live entries"""
+        now = time.monotonic()
+        return [
+            (key, value) for key, (expires_at, value) in self._entries.items()
+            if expires_at is None or expires_at > now
+        ]
+
+    def pop(self, key: KeyType) -> ValueType | None:
+        """Removes and returns the entry for `key`, if any"""
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self) -> None:
+        """Removes every entry"""
+        self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the size and hit counts of the cache"""
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
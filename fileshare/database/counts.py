@@ -0,0 +1,92 @@
+#!/bin/env python
+"""Maintains and recomputes the denormalized `File.share_count` and `File.download_count`.
+
+`share_count` is kept up to date by the `share_file_counts` trigger. Downloads
+only update their `share` row, so that concurrent downloads of one file's
+shares do not queue up on the `file` row's lock; they are added to
+`download_count` in batches by `roll_up_download_counts`, which the reaper and
+the write-behind download counter run.
+
+Recomputing is only needed for data which existed before the trigger was
+installed or which was modified with the trigger disabled. Run with:
+
+    python -m fileshare.database.counts
+"""
+import asyncio
+from collections import defaultdict
+from uuid import UUID
+
+from sqlalchemy import Integer, UUID as SQLUUID, column, func, select, tuple_, update, values
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from fileshare.database.engine import engine, get_session
+from fileshare.database.models import File, Share
+
+
+async def add_file_download_counts(conn: AsyncConnection, deltas: dict[UUID, int]) -> None:
+    """Adds per-file download deltas to `File.download_count` in one statement"""
+    # Sorted so concurrent writers lock rows in the same order
+    rows = sorted((file_id, delta) for file_id, delta in deltas.items() if file_id is not None and delta != 0)
+    if not rows:
+        return
+    v = values(column("id", SQLUUID(as_uuid=True)), column("delta", Integer), name="v").data(rows)
+    await conn.execute(
+        update(File)
+        .where(File.id == v.c.id)
+        .values(download_count=File.download_count + v.c.delta, updated=File.updated)
+    )
+
+async def roll_up_download_counts(conn: AsyncConnection, limit: int) -> int:
+    """Adds the downloads of up to `limit` shares to their files' `download_count`.
+
+    Shares locked by downloads in progress are skipped until the next call.
+    Returns the number of shares rolled up.
+    """
+    before = (
+        select(Share.id, Share.download_rolled.label("before"))
+        .where(Share.download_count != Share.download_rolled)
+        .order_by(Share.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .subquery()
+    )
+    rows = (await conn.execute(
+        update(Share)
+        .where(Share.id == before.c.id)
+        .values(download_rolled=Share.download_count, updated=Share.updated)
+        .returning(Share.file_id, Share.download_count - before.c.before)
+    )).all()
+    deltas: defaultdict[UUID, int] = defaultdict(int)
+    for file_id, delta in rows:
+        deltas[file_id] += delta
+    await add_file_download_counts(conn, deltas)
+    return len(rows)
+
+async def recompute_file_counts() -> int:
+    """Recomputes the share aggregates of every file, returning the number of rows corrected"""
+    share_count = select(func.count(Share.id)).where(Share.file_id == File.id).scalar_subquery()
+    download_count = select(func.coalesce(func.sum(Share.download_count), 0)).where(Share.file_id == File.id).scalar_subquery()
+
+    async with get_session() as session:
+        await session.execute(
+            update(Share)
+            .where(Share.download_rolled != Share.download_count)
+            .values(download_rolled=Share.download_count, updated=Share.updated)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(
+            update(File)
+            .where(tuple_(File.share_count, File.download_count).is_distinct_from(tuple_(share_count, download_count)))
+            .values(share_count=share_count, download_count=download_count, updated=File.updated)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return result.rowcount
+
+async def main():
+    n_rows = await recompute_file_counts()
+    print(f"Corrected share counts for {n_rows} file(s).")
+    await engine.dispose()
+
+if __name__=="__main__":
+    asyncio.run(main())
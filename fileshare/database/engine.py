@@ -2,11 +2,18 @@ from fileshare.settings import settings
 
 from sqlalchemy.ext.declarative import declarative_base
 
-from typing import AsyncGenerator
+import asyncio
+from uuid import uuid4
+from typing import Any, AsyncGenerator
 from contextlib import asynccontextmanager
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import configure_mappers
 
+from fileshare.database.pool import InstrumentedPool
+from fileshare.database.replicas import ReplicaSet
+
 dbc = settings.database
 
 creds = dbc.username
@@ -20,16 +27,78 @@ if dbc.port:
 SQLALCHEMY_DATABASE_URL = f"{dbc.protocol}://{creds}{dbc.hostname}{port}/{dbc.database}"
 
 connect_args = {}
+engine_args = {}
 if dbc.protocol == "sqlite":
     connect_args["check_same_thread"] = False
+else:
+    engine_args = {
+        "pool_size": dbc.pool_size,
+        "max_overflow": dbc.max_overflow,
+        "pool_timeout": dbc.pool_timeout,
+        "pool_recycle": dbc.pool_recycle,
+        "pool_pre_ping": dbc.pool_pre_ping,
+    }
+
+prepared_statement_cache_size = dbc.prepared_statement_cache_size
+if "asyncpg" in dbc.protocol:
+    connect_args["timeout"] = dbc.connect_timeout
+    connect_args["command_timeout"] = dbc.command_timeout
+    connect_args["statement_cache_size"] = dbc.statement_cache_size
+    if dbc.pgbouncer:
+        # pgbouncer may run each transaction on a different server connection,
+        # where statements prepared on another connection don't exist and
+        # names may collide
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+        prepared_statement_cache_size = 0
+
+def make_engine(url: str) -> AsyncEngine:
+    """Creates an engine for the primary or a replica with the configured pool and caches"""
+    url = make_url(url)
+    if "asyncpg" in url.drivername:
+        url = url.update_query_dict({"prepared_statement_cache_size": str(prepared_statement_cache_size)})
+    if engine_args:
+        return create_async_engine(url, connect_args=connect_args, poolclass=InstrumentedPool.with_stats(), **engine_args)
+    return create_async_engine(url, connect_args=connect_args)
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, connect_args = connect_args)
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+replicas = ReplicaSet(engine, [make_engine(url) for url in dbc.replicas], dbc)
 configure_mappers()
 
 async_session = async_sessionmaker(bind=engine, autoflush=False)
 
+def pool_stats() -> dict[str, Any]:
+    """Returns the connection pool statistics, or an empty dict for an uninstrumented pool"""
+    pool = engine.pool
+    if isinstance(pool, InstrumentedPool):
+        return pool.stats()
+    return {}
+
+async def open_read_session(**kwargs: Any) -> AsyncSession:
+    """Opens a read-only session on the next usable replica, or else on the primary.
+
+    A replica which can't be connected to is skipped until its next check.
+    """
+    while (sessionmaker := replicas.sessionmaker()) is not None:
+        session = sessionmaker(**kwargs)
+        try:
+            await session.connection(execution_options={"postgresql_readonly": True})
+            return session
+        except (DBAPIError, OSError) as e:
+            print(e)
+            await session.close()
+            replicas.mark_unhealthy(sessionmaker)
+    session = async_session(**kwargs)
+    await session.connection(execution_options={"postgresql_readonly": True})
+    return session
+
 @asynccontextmanager
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
+async def get_session(read_only: bool = False) -> AsyncGenerator[AsyncSession, None]:
+    if read_only:
+        # The read-only transaction is already begun when the session is opened
+        async with await open_read_session() as session:
+            yield session
+        return
     async with async_session() as session:
         async with session.begin():
             try:
@@ -37,4 +106,77 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
             finally:
                 await session.close()
 
+
+class RequestSession:
+
+    """A database session shared by the resolvers of one GraphQL operation.
+
+    The session is opened lazily on first use and access is serialized, since
+    an `AsyncSession` cannot be used concurrently. Sessions acquired for
+    reading run in a read-only transaction on a replica, when one is usable,
+    or on the primary when `primary_reads` is set. Acquiring for writing
+    upgrades to a writable session on the primary, which later reads keep
+    using. Writers commit or roll back explicitly. An exception in a resolver
+    discards the session, so later resolvers start afresh.
+
+    Attributes:
+        wrote -- Whether the session was acquired for writing.
+        reads_primary -- Whether reads go to the primary.
+        may_read_replica -- Whether reads may be served by a replica, which
+            might not have replayed the latest commits yet.
+
+    Methods:
+        acquire(write) -- An async context manager yielding the session.
+
+        close() -- Releases the session and its connection.
+    """
+
+    def __init__(self, primary_reads: bool = False) -> None:
+        self._session: AsyncSession | None = None
+        self._writable = False
+        self._primary_reads = primary_reads
+        self._lock = asyncio.Lock()
+        self.wrote = False
+
+    @property
+    def reads_primary(self) -> bool:
+        return self._primary_reads or self.wrote
+
+    @property
+    def may_read_replica(self) -> bool:
+        return replicas.configured and not self.reads_primary
+
+    async def _open(self, write: bool) -> AsyncSession:
+        if write:
+            return async_session(expire_on_commit=False)
+        if self._primary_reads:
+            session = async_session(expire_on_commit=False)
+            await session.connection(execution_options={"postgresql_readonly": True})
+            return session
+        return await open_read_session(expire_on_commit=False)
+
+    @asynccontextmanager
+    async def acquire(self, write: bool = False) -> AsyncGenerator[AsyncSession, None]:
+        async with self._lock:
+            if self._session is not None and write and not self._writable:
+                await self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = await self._open(write)
+                self._writable = write
+            self.wrote = self.wrote or write
+            try:
+                yield self._session
+            except BaseException:
+                await self._session.close()
+                self._session = None
+                raise
+
+    async def close(self) -> None:
+        """Releases the session, rolling back anything uncommitted"""
+        async with self._lock:
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+
 Base = declarative_base()
@@ -1,7 +1,7 @@
 import uuid
 
-from sqlalchemy import UUID, Column, Computed, Index, Integer, DateTime, String, Boolean, ForeignKey, literal, select, text
-from sqlalchemy.orm import column_property, relationship
+from sqlalchemy import DDL, UUID, BigInteger, Column, Computed, Index, Integer, DateTime, String, Boolean, ForeignKey, event, literal, text
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy_utils.types.ts_vector import TSVectorType
@@ -22,13 +22,34 @@ class Share(Base):
     created = Column(DateTime, server_default=func.now(), nullable=False)
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
-    file_id = Column(UUID(as_uuid=True), ForeignKey("file.id", ondelete="CASCADE"))
+    file_id = Column(UUID(as_uuid=True), ForeignKey("file.id", ondelete="CASCADE"), index=True)
     file = relationship("File", back_populates="shares")
 
     key = Column(String, nullable=False, unique=True)
     expiry = Column(DateTime)
     download_limit = Column(Integer, server_default="0", nullable=False)
     download_count = Column(Integer, server_default="0", nullable=False)
+    # Downloads reserved by write-behind counters but not yet served; they
+    # count against `download_limit` but not towards `download_count`. Each
+    # counter's share of them is held in `share_reservation`
+    download_reserved = Column(Integer, server_default="0", nullable=False)
+    # The part of `download_count` already added to `file.download_count`;
+    # the rest is rolled up in batches, away from the download path
+    download_rolled = Column(Integer, server_default="0", nullable=False)
+
+    # Keyset pagination indexes, one per `ShareSortField`
+    __table_args__ = (
+        Index('idx_share_created', created, updated, id),
+        Index('idx_share_updated', updated, created, id),
+        Index('idx_share_expiry', expiry, updated, created, id),
+        Index('idx_share_download_count', download_count, updated, created, id),
+        Index('idx_share_download_limit', download_limit, updated, created, id),
+        # Candidates for the reaper
+        Index('idx_share_expired', expiry, id, postgresql_where=expiry.isnot(None)),
+        Index('idx_share_exhausted', id, postgresql_where=(download_limit > 0) & (download_count >= download_limit)),
+        # Shares with downloads not yet rolled up into `file.download_count`
+        Index('idx_share_unrolled', id, postgresql_where=download_count != download_rolled),
+    )
 
 
 class File(Base):
@@ -45,8 +66,10 @@ class File(Base):
     active = Column(Boolean, default=True)
 
     shares = relationship("Share", cascade="all, delete", passive_deletes=True, back_populates="file")
-    share_count = column_property(select(func.count(Share.id)).where(Share.file_id==id).scalar_subquery())
-    download_count = column_property(select(func.coalesce(func.sum(Share.download_count), 0)).where(Share.file_id==id).scalar_subquery())
+    # Denormalized aggregates over `share`, maintained by the `share_file_counts`
+    # trigger; downloads are added to `download_count` by `roll_up_download_counts`
+    share_count = Column(Integer, server_default="0", nullable=False)
+    download_count = Column(Integer, server_default="0", nullable=False)
 
     tsvector = Column(TSVectorType("tsvector", regconfig="english"), Computed("to_tsvector('english', regexp_replace(\"object_name\", '[^\w]+', ' ', 'g'))", persisted=True))
 
@@ -56,6 +79,74 @@ class File(Base):
             tsvector,
             postgresql_using='gin'
         ),
+        # Keyset pagination indexes, one per `FileSortField`
+        Index('idx_file_object_name', object_name, updated, created, id),
+        Index('idx_file_created', created, updated, id),
+        Index('idx_file_updated', updated, created, id),
+        Index('idx_file_share_count', share_count, updated, created, id),
+        Index('idx_file_download_count', download_count, updated, created, id),
+        # Byte-wise name order, matching the order in which the bucket is listed
+        Index('idx_file_object_name_c', object_name.collate("C")),
+        # Substring search of names
+        Index(
+            'idx_file_object_name_trgm',
+            object_name,
+            postgresql_using='gin',
+            postgresql_ops={'object_name': 'gin_trgm_ops'}
+        ),
+    )
+
+
+event.listen(File.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+
+# Keeps `file.share_count` and the rolled up part of `file.download_count` in
+# step with `share` within the transaction that adds, removes or moves the
+# share. Downloads do not fire it, so they never lock the `file` row.
+share_file_counts_function = DDL("""
+CREATE OR REPLACE FUNCTION share_file_counts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.file_id IS NOT DISTINCT FROM NEW.file_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE file SET share_count = share_count - 1, download_count = download_count - OLD.download_rolled
+        WHERE id = OLD.file_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE file SET share_count = share_count + 1, download_count = download_count + NEW.download_rolled
+        WHERE id = NEW.file_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""")
+
+share_file_counts_trigger = DDL("""
+CREATE TRIGGER share_file_counts
+AFTER INSERT OR DELETE OR UPDATE OF file_id ON share
+FOR EACH ROW EXECUTE FUNCTION share_file_counts()
+""")
+
+event.listen(Share.__table__, "after_create", share_file_counts_function.execute_if(dialect="postgresql"))
+event.listen(Share.__table__, "after_create", share_file_counts_trigger.execute_if(dialect="postgresql"))
+
+
+class ShareReservation(Base):
+
+    """A model for the downloads of a share reserved by one write-behind counter"""
+
+    __tablename__ = "share_reservation"
+
+    share_id = Column(UUID(as_uuid=True), ForeignKey("share.id", ondelete="CASCADE"), primary_key=True)
+    owner = Column(UUID(as_uuid=True), primary_key=True)
+    reserved = Column(Integer, nullable=False)
+    # Renewed by the owner while it runs; the reaper releases stale reservations
+    renewed = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index('idx_share_reservation_owner', owner),
+        Index('idx_share_reservation_renewed', renewed, share_id, owner),
     )
 
 
@@ -69,5 +160,18 @@ class Upload(Base):
     created = Column(DateTime, server_default=func.now(), nullable=False)
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
-    key = Column(String, nullable=False)
+    key = Column(String, nullable=False, unique=True)
     expiry = Column(DateTime)
+
+    # Set once the upload is started: the name of the file being uploaded, its
+    # declared size, the ID of its multipart upload if it is uploaded in parts,
+    # and the inactive file row which reserves the name until it is completed
+    object_name = Column(String)
+    size = Column(BigInteger)
+    multipart_id = Column(String)
+    file_id = Column(UUID(as_uuid=True), ForeignKey("file.id", ondelete="SET NULL"), index=True)
+
+    # Candidates for the reaper
+    __table_args__ = (
+        Index('idx_upload_expired', expiry, id, postgresql_where=expiry.isnot(None)),
+    )
@@ -0,0 +1,75 @@
+import time
+from typing import Any
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolStats:
+
+    """Counters describing how long requests waited for a pooled connection.
+
+    Attributes:
+        checkouts -- The number of connections handed out by the pool.
+        timeouts -- The number of checkouts which gave up after `pool_timeout`.
+        wait_time -- The total time (in seconds) spent waiting for checkouts,
+            including opening new connections.
+        max_wait_time -- The longest single wait (in seconds).
+    """
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record(self, wait_time: float, timed_out: bool) -> None:
+        if timed_out:
+            self.timeouts += 1
+        else:
+            self.checkouts += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+
+    """An `AsyncAdaptedQueuePool` which records checkout wait times in `checkout_stats`.
+
+    Use `with_stats()` to get a pool class for each engine. The counters are
+    kept on the class, since a pool which is recreated (e.g. after a
+    disconnect) is a new instance of the same class.
+    """
+
+    checkout_stats: PoolStats
+
+    @classmethod
+    def with_stats(cls) -> type["InstrumentedPool"]:
+        """Returns a subclass with its own counters"""
+        return type(cls.__name__, (cls,), {"checkout_stats": PoolStats()})
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.checkout_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.checkout_stats.record(time.perf_counter() - start, timed_out=False)
+        return connection
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the live state of the pool along with the checkout counters"""
+        stats = self.checkout_stats
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_time": stats.wait_time,
+            "max_wait_time": stats.max_wait_time,
+            "avg_wait_time": stats.wait_time / stats.checkouts if stats.checkouts else 0.0,
+        }
@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from fileshare.database.pool import InstrumentedPool
+from fileshare.settings.database import DatabaseSettings
+
+# The primary's current WAL position, as text
+PRIMARY_LSN_QUERY = text("SELECT CASE WHEN pg_is_in_recovery() THEN NULL ELSE pg_current_wal_lsn()::text END")
+
+# Whether the replica's WAL receiver is streaming from the primary, and its
+# lag in seconds: 0 once it has replayed the primary's WAL position (given as
+# :primary_lsn, or when that is unknown, everything it has received), else the
+# time since it last replayed a transaction, or NULL if it has replayed none
+# since it started. Without pg_read_all_stats the receiver's status reads as
+# NULL, and only the receiver's presence is checked.
+LAG_QUERY = text("""
+    SELECT
+        NOT pg_is_in_recovery() OR EXISTS (
+            SELECT FROM pg_stat_wal_receiver
+            WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming'
+        ),
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_replay_lsn() >= CAST(CAST(:primary_lsn AS text) AS pg_lsn) THEN 0
+            WHEN CAST(:primary_lsn AS text) IS NULL AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+""")
+
+
+class Replica:
+
+    """A read replica and its last known state.
+
+    Attributes:
+        engine -- The replica's engine.
+        sessionmaker -- Creates sessions bound to the replica.
+        healthy -- Whether the last check reached the replica.
+        streaming -- Whether the replica was receiving WAL from the primary
+            at the last check.
+        lag -- The replication lag (in seconds) seen by the last check, or
+            None if it could not be told.
+    """
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        self.sessionmaker = async_sessionmaker(bind=engine, autoflush=False)
+        self.healthy = False
+        self.streaming = False
+        self.lag: float | None = None
+
+    async def _measure_lag(self, primary_lsn: str | None) -> tuple[bool, float | None]:
+        async with self.engine.connect() as conn:
+            streaming, lag = (await conn.execute(LAG_QUERY, {"primary_lsn": primary_lsn})).one()
+            return streaming, float(lag) if lag is not None else None
+
+    async def check(self, timeout: float, primary_lsn: str | None = None) -> None:
+        """Measures the replica's lag behind `primary_lsn`, marking it unhealthy if it can't be reached"""
+        try:
+            self.streaming, self.lag = await asyncio.wait_for(self._measure_lag(primary_lsn), timeout=timeout)
+            self.healthy = True
+        except Exception as e:
+            print(e)
+            self.healthy = False
+
+
+class ReplicaSet:
+
+    """Routes reads round-robin across the read replicas.
+
+    Replicas are checked at startup and then every
+    `DATABASE__REPLICA_CHECK_INTERVAL` seconds, against the primary's current
+    WAL position. Replicas which could not be reached, which are not streaming
+    WAL from the primary, or which lag it by more than
+    `DATABASE__REPLICA_MAX_LAG` seconds, are skipped until a later check finds
+    them usable again. With no usable replica, reads fall back to the primary.
+
+    Attributes:
+        configured -- Whether there are any replicas.
+        max_staleness -- For how many seconds after a commit on the primary a
+            usable replica may not have replayed it yet.
+
+    Methods:
+        sessionmaker() -- Returns the sessionmaker of the next usable replica,
+            or None to read from the primary.
+
+        mark_unhealthy(sessionmaker) -- Skips a replica which failed, until its
+            next check.
+
+        stats() -- Returns the state of each replica.
+
+        start() -- Checks the replicas and starts checking them periodically.
+
+        close() -- Stops checking and disposes of the replica engines.
+    """
+
+    def __init__(self, primary: AsyncEngine, engines: list[AsyncEngine], conf: DatabaseSettings) -> None:
+        self._conf = conf
+        self._primary = primary
+        self._replicas = [Replica(engine) for engine in engines]
+        self._next = itertools.cycle(self._replicas)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._replicas)
+
+    @property
+    def max_staleness(self) -> float:
+        # A replica's lag may have grown since its last check
+        return self._conf.replica_max_lag + self._conf.replica_check_interval if self._replicas else 0
+
+    def _usable(self, replica: Replica) -> bool:
+        return replica.healthy and replica.streaming and replica.lag is not None and replica.lag <= self._conf.replica_max_lag
+
+    def sessionmaker(self) -> async_sessionmaker[AsyncSession] | None:
+        for _ in range(len(self._replicas)):
+            replica = next(self._next)
+            if self._usable(replica):
+                return replica.sessionmaker
+        return None
+
+    def mark_unhealthy(self, sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+        for replica in self._replicas:
+            if replica.sessionmaker is sessionmaker:
+                replica.healthy = False
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "host": replica.engine.url.host,
+                "healthy": replica.healthy,
+                "streaming": replica.streaming,
+                "lag": replica.lag,
+                "usable": self._usable(replica),
+                "pool": replica.engine.pool.stats() if isinstance(replica.engine.pool, InstrumentedPool) else {},
+            }
+            for replica in self._replicas
+        ]
+
+    async def _primary_lsn(self) -> str | None:
+        async with self._primary.connect() as conn:
+            return (await conn.execute(PRIMARY_LSN_QUERY)).scalar()
+
+    async def _check(self) -> None:
+        timeout = self._conf.replica_check_interval
+        try:
+            primary_lsn = await asyncio.wait_for(self._primary_lsn(), timeout=timeout)
+        except Exception as e:
+            print(e)
+            primary_lsn = None
+        await asyncio.gather(*(r.check(timeout, primary_lsn) for r in self._replicas))
+
+    async def _recheck(self) -> None:
+        while True:
+            await asyncio.sleep(self._conf.replica_check_interval)
+            await self._check()
+
+    async def start(self) -> None:
+        if self._replicas:
+            await self._check()
+            self._task = asyncio.create_task(self._recheck())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self._replicas:
+            await replica.engine.dispose()
@@ -0,0 +1,355 @@
+import asyncio
+import time
+import uuid
+from uuid import UUID
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import Integer, UUID as SQLUUID, column, delete, or_, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.sql import func
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import RedirectResponse
+
+from fileshare.settings import settings
+from fileshare.settings.download import DownloadSettings
+from fileshare.database.counts import add_file_download_counts
+from fileshare.database.engine import engine
+from fileshare.database.models import File, Share, ShareReservation
+from fileshare.graphql.context import mark_written
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.storage.minio import storage
+
+
+async def claim_download(key: str) -> str | None:
+    """Counts a download of the share `key`, returning the shared object's name.
+
+    The expiry and download limit are checked, the download counted and the
+    object name fetched in one conditional `UPDATE ... RETURNING`, run in
+    autocommit mode so a download costs a single database round trip. Row
+    locking makes concurrent downloads re-check the limit against the latest
+    count, so a share is never downloaded more than `download_limit` times.
+    A `download_limit` of 0 means the share may be downloaded without limit.
+    Only the `share` row is updated; the download is added to the file's
+    `download_count` when the reaper next rolls up download counts. Cached
+    responses reading shares are invalidated once the download is counted.
+
+    Returns None if the share does not exist, has expired or is exhausted.
+    """
+    claim = (
+        update(Share)
+        .where(
+            Share.key == key,
+            Share.file_id == File.id,
+            File.active.isnot(False),
+            or_(Share.expiry.is_(None), Share.expiry > func.now()),
+            or_(Share.download_limit <= 0, Share.download_count + Share.download_reserved < Share.download_limit),
+        )
+        .values(download_count=Share.download_count + 1, updated=Share.updated)
+        .returning(File.object_name)
+    )
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        object_name = (await conn.execute(claim)).scalar()
+    if object_name is not None:
+        await invalidate_responses("share")
+    return object_name
+
+
+async def release_stale_reservations(conn: AsyncConnection, lease: float, limit: int) -> int:
+    """Gives back up to `limit` reservations not renewed for `lease` seconds.
+
+    These were left by write-behind counters which stopped without closing,
+    so their reserved downloads would otherwise count against the shares'
+    limits for good. Returns the number of reservations released.
+    """
+    stale = (
+        select(ShareReservation.share_id, ShareReservation.owner)
+        .where(ShareReservation.renewed < func.now() - timedelta(seconds=lease))
+        .order_by(ShareReservation.renewed)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = (await conn.execute(
+        delete(ShareReservation)
+        .where(tuple_(ShareReservation.share_id, ShareReservation.owner).in_(stale))
+        .returning(ShareReservation.share_id, ShareReservation.reserved)
+    )).all()
+    released: defaultdict[UUID, int] = defaultdict(int)
+    for share_id, reserved in rows:
+        released[share_id] += reserved
+    if released:
+        v = values(column("id", SQLUUID(as_uuid=True)), column("released", Integer), name="v").data(sorted(released.items()))
+        await conn.execute(
+            update(Share)
+            .where(Share.id == v.c.id)
+            .values(download_reserved=func.greatest(Share.download_reserved - v.c.released, 0), updated=Share.updated)
+        )
+    return len(rows)
+
+
+class WriteBehindCounter:
+
+    """Counts share downloads in memory and writes them to the database in batches.
+
+    Downloads of one popular share would otherwise all update the same `share`
+    row, queueing up on its row lock. Instead, per-share deltas are collected
+    and written with one `UPDATE ... FROM (VALUES ...)` statement every
+    `DOWNLOAD__FLUSH_INTERVAL` seconds, or as soon as
+    `DOWNLOAD__FLUSH_THRESHOLD` downloads are pending.
+
+    Shares with a download limit are still enforced exactly: a worker reserves
+    up to `DOWNLOAD__RESERVATION_SIZE` downloads at a time by adding them to
+    `download_reserved` (never beyond the limit, counting downloads already
+    made) and hands them out locally. Each download served from a reservation
+    is written as one more `download_count` and one less `download_reserved`,
+    so `download_count` only ever counts downloads which were made, and the
+    reaper never deletes a share whose reserved downloads are still open.
+    Unused reservations are given back when the counter is closed.
+
+    A worker which dies without closing its counter (killed, or out of
+    memory) can not give its reservations back, so each counter also records
+    its reservations in `share_reservation` under its own ID, and renews them
+    as it flushes. The reaper releases the reservations which have not been
+    renewed for `DOWNLOAD__RESERVATION_LEASE` seconds.
+
+    Methods:
+        claim(key) -- Counts a download of the share `key`, returning the name
+            of the shared object, or None if the share is unavailable.
+
+        flush() -- Writes the pending download counts, adding them to their
+            files' `download_count` as well, and invalidates the cached
+            responses reading them.
+
+        start() -- Starts the background flush task.
+
+        close() -- Stops the background task, releases reservations and
+            writes everything still pending.
+    """
+
+    def __init__(self, conf: DownloadSettings | None = None) -> None:
+        if not conf:
+            conf = settings.download
+
+        self._flush_interval = conf.flush_interval
+        self._flush_threshold = conf.flush_threshold
+        self._reservation_size = conf.reservation_size
+        # Reservations are recorded under this counter's own ID, and renewed
+        # four times per lease
+        self._owner = uuid.uuid4()
+        self._renew_interval = conf.reservation_lease / 4
+        self._renewed = time.monotonic()
+
+        self._deltas: defaultdict[UUID, int] = defaultdict(int)
+        self._reserved_deltas: defaultdict[UUID, int] = defaultdict(int)
+        self._pending = 0
+        self._reservations: dict[UUID, int] = {}
+        self._flush_now = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _count(self, share_id: UUID, n: int, reserved: int = 0) -> None:
+        self._deltas[share_id] += n
+        self._reserved_deltas[share_id] += reserved
+        self._pending += max(abs(n), abs(reserved))
+        if self._pending >= self._flush_threshold:
+            self._flush_now.set()
+
+    async def _reserve(self, share_id: UUID) -> int:
+        """Reserves downloads of a share for this counter, returning how many were granted"""
+        before = (
+            select(Share.id, Share.download_reserved.label("before"))
+            .where(Share.id == share_id)
+            .with_for_update()
+            .subquery()
+        )
+        reserve = (
+            update(Share)
+            .where(Share.id == before.c.id, Share.download_count + Share.download_reserved < Share.download_limit)
+            .values(
+                download_reserved=func.least(
+                    Share.download_reserved + self._reservation_size,
+                    Share.download_limit - Share.download_count
+                ),
+                updated=Share.updated
+            )
+            .returning(Share.download_reserved - before.c.before)
+        )
+        async with engine.begin() as conn:
+            granted = (await conn.execute(reserve)).scalar() or 0
+            if granted:
+                record = insert(ShareReservation).values(share_id=share_id, owner=self._owner, reserved=granted)
+                await conn.execute(record.on_conflict_do_update(
+                    index_elements=[ShareReservation.share_id, ShareReservation.owner],
+                    set_={"reserved": ShareReservation.reserved + record.excluded.reserved, "renewed": func.now()}
+                ))
+        return granted
+
+    async def claim(self, key: str) -> str | None:
+        """Counts a download of the share `key`, returning the shared object's name"""
+        lookup = (
+            select(Share.id, Share.download_limit, File.object_name)
+            .join(File, Share.file_id == File.id)
+            .where(
+                Share.key == key,
+                File.active.isnot(False),
+                or_(Share.expiry.is_(None), Share.expiry > func.now()),
+            )
+        )
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            row = (await conn.execute(lookup)).first()
+        if row is None:
+            return None
+        share_id, download_limit, object_name = row
+
+        if download_limit <= 0:
+            self._count(share_id, 1)
+            return object_name
+
+        if not self._reservations.get(share_id):
+            granted = await self._reserve(share_id)
+            self._reservations[share_id] = self._reservations.get(share_id, 0) + granted
+
+        if not self._reservations.get(share_id):
+            self._reservations.pop(share_id, None)
+            return None
+        self._reservations[share_id] -= 1
+        self._count(share_id, 1, reserved=-1)
+        return object_name
+
+    async def flush(self) -> None:
+        """Writes the pending download counts of shares, and then of their files"""
+        deltas, self._deltas = self._deltas, defaultdict(int)
+        reserved_deltas, self._reserved_deltas = self._reserved_deltas, defaultdict(int)
+        self._pending = 0
+        # Sorted so concurrent flushes from several workers lock rows in the same order
+        rows = sorted(
+            (share_id, deltas[share_id], reserved_deltas[share_id])
+            for share_id in deltas.keys() | reserved_deltas.keys()
+            if deltas[share_id] != 0 or reserved_deltas[share_id] != 0
+        )
+        now = time.monotonic()
+        renew = bool(self._reservations) and now - self._renewed >= self._renew_interval
+        if not rows:
+            if renew:
+                async with engine.begin() as conn:
+                    await self._renew(conn)
+                self._renewed = now
+            return
+
+        v = values(
+            column("id", SQLUUID(as_uuid=True)),
+            column("delta", Integer),
+            column("reserved_delta", Integer),
+            name="v"
+        ).data(rows)
+        try:
+            async with engine.begin() as conn:
+                # The flushed downloads are rolled up into their files' counts
+                # in the same transaction, one row per file
+                result = await conn.execute(
+                    update(Share)
+                    .where(Share.id == v.c.id)
+                    .values(
+                        download_count=Share.download_count + v.c.delta,
+                        # Never below 0, should the reaper have released the
+                        # reservations while this counter could not renew them
+                        download_reserved=func.greatest(Share.download_reserved + v.c.reserved_delta, 0),
+                        download_rolled=Share.download_rolled + v.c.delta,
+                        updated=Share.updated
+                    )
+                    .returning(Share.id, Share.file_id)
+                )
+                file_deltas: defaultdict[UUID, int] = defaultdict(int)
+                for share_id, file_id in result.all():
+                    file_deltas[file_id] += deltas[share_id]
+                await add_file_download_counts(conn, file_deltas)
+                await conn.execute(
+                    update(ShareReservation)
+                    .where(
+                        ShareReservation.share_id == v.c.id,
+                        ShareReservation.owner == self._owner,
+                        v.c.reserved_delta != 0
+                    )
+                    .values(reserved=ShareReservation.reserved + v.c.reserved_delta)
+                )
+                await conn.execute(
+                    delete(ShareReservation)
+                    .where(ShareReservation.owner == self._owner, ShareReservation.reserved <= 0)
+                )
+                if renew:
+                    await self._renew(conn)
+        except Exception:
+            for share_id, delta, reserved_delta in rows:
+                self._count(share_id, delta, reserved_delta)
+            raise
+        if renew:
+            self._renewed = now
+        if any(delta for _, delta, _ in rows):
+            await invalidate_responses("share", "file")
+
+    async def _renew(self, conn: AsyncConnection) -> None:
+        """Renews the lease on this counter's reservations"""
+        await conn.execute(
+            update(ShareReservation)
+            .where(ShareReservation.owner == self._owner)
+            .values(renewed=func.now())
+        )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(e)
+
+    async def start(self) -> None:
+        """Starts the background flush task"""
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stops the background flush task and writes everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        reservations, self._reservations = self._reservations, {}
+        for share_id, remaining in reservations.items():
+            if remaining:
+                self._count(share_id, 0, reserved=-remaining)
+        await self.flush()
+
+
+download_counter = WriteBehindCounter() if settings.download.write_behind else None
+
+async def download_url(key: str) -> str | None:
+    """Counts a download of the share `key` and returns a presigned url for its file"""
+    if download_counter is not None:
+        object_name = await download_counter.claim(key)
+    else:
+        object_name = await claim_download(key)
+    if object_name is None:
+        return None
+    return await storage.presigned_get(object_name, object_name.rsplit("/", 1)[-1])
+
+
+router = APIRouter()
+
+@router.get("/d/{key}")
+async def download(key: str) -> RedirectResponse:
+    """Redirects to a short-lived download url for the share `key`"""
+    url = await download_url(key)
+    if url is None:
+        raise HTTPException(status_code=404, detail="Share not found, expired or exhausted.")
+    response = RedirectResponse(url, status_code=302)
+    mark_written(response)
+    return response
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Any, AsyncContextManager, AsyncGenerator
+
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.types import Info
+
+from fileshare.settings import settings
+from fileshare.database.engine import RequestSession
+from fileshare.graphql.dataloaders import Loaders
+
+# Holds the time until which a client that has just written reads from the primary
+READ_YOUR_WRITES_COOKIE = "fileshare_primary_until"
+
+
+def reads_primary(request: Request) -> bool:
+    """Whether the client is still within the read-your-writes window of its last mutation"""
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+async def get_context(request: Request) -> AsyncGenerator[dict[str, Any], None]:
+    """Builds the per-request GraphQL context, releasing its session after the request.
+
+    Tasks started on behalf of the request are kept in `tasks`; any still
+    running when the request ends (a resolver which would have awaited them
+    failed, or the operation was cancelled) are cancelled, and their outcome
+    collected so that their errors are not reported as never retrieved.
+    """
+    session = RequestSession(primary_reads=reads_primary(request))
+    tasks: set[asyncio.Task] = set()
+    try:
+        yield {
+            "session": session,
+            "loaders": Loaders(session),
+            "tasks": tasks,
+        }
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await session.close()
+
+def mark_written(response: Response) -> None:
+    """Opens the client's read-your-writes window, when `DATABASE__READ_YOUR_WRITES` is set.
+
+    Called by every request which writes, including those which do not write
+    through the request's session.
+    """
+    window = settings.database.read_your_writes
+    if window > 0:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            str(time.time() + window),
+            max_age=int(window) + 1,
+            httponly=True
+        )
+
+def request_session(info: Info, write: bool = False) -> AsyncContextManager[AsyncSession]:
+    """Acquires the operation's shared database session.
+
+    Acquiring it for writing opens the client's read-your-writes window.
+    """
+    if write:
+        mark_written(info.context["response"])
+    return info.context["session"].acquire(write=write)
@@ -0,0 +1,127 @@
+import hmac
+import struct
+import hashlib
+import binascii
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any
+from uuid import UUID
+
+from fileshare.settings import settings
+
+# Cursor layout (before url-safe base64 without padding):
+#   version (1 byte) | sort spec digest (4 bytes) | values | HMAC (12 bytes)
+# where each value is a one byte type tag followed by its packed data.
+VERSION = 1
+SPEC_SIZE = 4
+MAC_SIZE = 12
+EPOCH = datetime(1970, 1, 1)
+
+NONE = b"n"
+TRUE = b"t"
+FALSE = b"f"
+INT = b"i"
+FLOAT = b"r"
+UUID_ = b"u"
+DATETIME = b"d"
+STRING = b"s"
+
+INT64 = struct.Struct(">q")
+DOUBLE = struct.Struct(">d")
+LENGTH = struct.Struct(">I")
+
+
+class CursorDecodeError(Exception):
+    """An exception to be raised when a cursor passed is malformed, forged or from another sort"""
+    pass
+
+
+def _key() -> bytes:
+    secret = settings.graphql.cursor_secret or settings.minio.secret_key
+    return hashlib.sha256(b"fileshare-cursor:" + secret.encode("utf-8")).digest()
+
+KEY = _key()
+
+@lru_cache(maxsize=128)
+def spec_digest(spec: str) -> bytes:
+    """Returns a short digest identifying a sort specification"""
+    return hashlib.blake2b(spec.encode("utf-8"), digest_size=SPEC_SIZE).digest()
+
+def _mac(data: bytes) -> bytes:
+    return hmac.new(KEY, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+def _pack(value: Any) -> bytes:
+    if value is None:
+        return NONE
+    if value is True:
+        return TRUE
+    if value is False:
+        return FALSE
+    if isinstance(value, int):
+        return INT + INT64.pack(value)
+    if isinstance(value, float):
+        return FLOAT + DOUBLE.pack(value)
+    if isinstance(value, UUID):
+        return UUID_ + value.bytes
+    if isinstance(value, datetime):
+        return DATETIME + INT64.pack((value - EPOCH) // timedelta(microseconds=1))
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return STRING + LENGTH.pack(len(data)) + data
+    raise TypeError(f"Cannot encode values of type {type(value).__name__} in a cursor.")
+
+def encode_cursor(place: tuple[Any, ...], spec: str) -> str:
+    """Encodes a keyset place as a signed cursor tied to a sort specification"""
+    data = bytes((VERSION,)) + spec_digest(spec) + b"".join(_pack(value) for value in place)
+    return urlsafe_b64encode(data + _mac(data)).rstrip(b"=").decode("ascii")
+
+def decode_cursor(cursor: str, spec: str) -> tuple[Any, ...]:
+    """Decodes a cursor created by `encode_cursor` for the same sort specification"""
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (binascii.Error, ValueError):
+        raise CursorDecodeError(f"Cursor '{cursor}' is not valid base64.")
+    if len(raw) < 1 + SPEC_SIZE + MAC_SIZE or raw[0] != VERSION:
+        raise CursorDecodeError("Cursor has an unknown format.")
+    if raw[1:1 + SPEC_SIZE] != spec_digest(spec):
+        raise CursorDecodeError("Cursor was created for a different sort order.")
+    data, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+    if not hmac.compare_digest(mac, _mac(data)):
+        raise CursorDecodeError("Cursor signature is invalid.")
+
+    place = []
+    view = memoryview(data)
+    i = 1 + SPEC_SIZE
+    try:
+        while i < len(data):
+            tag = data[i:i + 1]
+            i += 1
+            if tag == NONE:
+                place.append(None)
+            elif tag == TRUE:
+                place.append(True)
+            elif tag == FALSE:
+                place.append(False)
+            elif tag == INT:
+                place.append(INT64.unpack_from(view, i)[0])
+                i += INT64.size
+            elif tag == FLOAT:
+                place.append(DOUBLE.unpack_from(view, i)[0])
+                i += DOUBLE.size
+            elif tag == UUID_:
+                place.append(UUID(bytes=data[i:i + 16]))
+                i += 16
+            elif tag == DATETIME:
+                place.append(EPOCH + timedelta(microseconds=INT64.unpack_from(view, i)[0]))
+                i += INT64.size
+            elif tag == STRING:
+                length = LENGTH.unpack_from(view, i)[0]
+                i += LENGTH.size
+                place.append(data[i:i + length].decode("utf-8"))
+                i += length
+            else:
+                raise CursorDecodeError("Cursor contains an unknown value type.")
+    except (struct.error, ValueError):
+        raise CursorDecodeError("Cursor is truncated.")
+    return tuple(place)
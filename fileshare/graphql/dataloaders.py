@@ -0,0 +1,44 @@
+from uuid import UUID
+from functools import partial
+from collections import defaultdict
+
+from sqlalchemy import select
+from strawberry.dataloader import DataLoader
+
+from fileshare.database.engine import RequestSession
+from fileshare.database.models import File, Share
+
+
+async def load_files(request_session: RequestSession, ids: list[UUID]) -> list[File | None]:
+    """Batch loads files by ID with a single `WHERE id IN (...)` query"""
+    async with request_session.acquire() as session:
+        result = await session.execute(select(File).filter(File.id.in_(ids)))
+        files = {f.id: f for f in result.scalars().all()}
+    return [files.get(i) for i in ids]
+
+async def load_shares_by_file(request_session: RequestSession, file_ids: list[UUID]) -> list[list[Share]]:
+    """Batch loads the shares of each file with a single `WHERE file_id IN (...)` query"""
+    async with request_session.acquire() as session:
+        result = await session.execute(select(Share).filter(Share.file_id.in_(file_ids)))
+        shares = defaultdict(list)
+        for share in result.scalars().all():
+            shares[share.file_id].append(share)
+    return [shares[i] for i in file_ids]
+
+
+class Loaders:
+
+    """A request-scoped collection of DataLoaders.
+
+    A new instance must be created for every request so that cached results
+    are never shared between requests. Loaders query through the request's
+    shared session.
+
+    Attributes:
+        file -- Loads `File` rows by ID.
+        shares_by_file -- Loads the list of `Share` rows belonging to a file ID.
+    """
+
+    def __init__(self, session: RequestSession) -> None:
+        self.file = DataLoader(load_fn=partial(load_files, session))
+        self.shares_by_file = DataLoader(load_fn=partial(load_shares_by_file, session))
@@ -0,0 +1,24 @@
+import strawberry
+from strawberry.types import Info
+
+from fileshare.download import download_url
+from fileshare.graphql.context import mark_written
+from fileshare.graphql.download.types import DownloadError, DownloadType
+
+
+@strawberry.type
+class DownloadMutation:
+    """A Mutation class for downloading shares"""
+
+    @strawberry.mutation
+    async def download_share(
+        self,
+        info: Info,
+        key: str
+    ) -> DownloadType | DownloadError:
+
+        url = await download_url(key)
+        if url is None:
+            return DownloadError(code="download_share_unavailable", message=f"Share '{key}' was not found, has expired or has reached its download limit.")
+        mark_written(info.context["response"])
+        return DownloadType(url=url)
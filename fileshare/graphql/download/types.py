@@ -0,0 +1,12 @@
+import strawberry
+
+from fileshare.graphql.types import ErrorType
+
+
+@strawberry.type
+class DownloadType:
+    url: str
+
+@strawberry.type
+class DownloadError(ErrorType):
+    pass
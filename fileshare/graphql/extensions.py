@@ -0,0 +1,133 @@
+from typing import Any
+
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    GraphQLNamedType,
+    GraphQLObjectType,
+    GraphQLSchema,
+    InlineFragmentNode,
+    SelectionSetNode,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    get_operation_ast,
+    is_leaf_type,
+    value_from_ast_untyped,
+)
+from strawberry.extensions import SchemaExtension
+
+from fileshare.settings import settings
+from fileshare.settings.graphql import GraphQLSettings
+
+
+class QueryCost:
+
+    """Statically computes the cost of a GraphQL operation.
+
+    Every field costs its weight times the number of times it may be resolved,
+    which is the product of the page sizes (`first`/`last`, or the default page
+    size) of the connections above it and `GRAPHQL__COST_LIST_SIZE` for every
+    other list above it. Weights are configured per `Type.field` in
+    `GRAPHQL__FIELD_COSTS`; otherwise fields returning objects cost 1 and
+    scalar fields cost nothing. The depth is the deepest level of nested fields.
+    """
+
+    def __init__(self, schema: GraphQLSchema, fragments: dict[str, FragmentDefinitionNode], variables: dict[str, Any] | None, conf: GraphQLSettings) -> None:
+        self._schema = schema
+        self._fragments = fragments
+        self._variables = variables or {}
+        self._conf = conf
+        self.cost = 0
+        self.depth = 0
+
+    def _argument(self, node: FieldNode, name: str) -> Any:
+        for argument in node.arguments:
+            if argument.name.value == name:
+                if isinstance(argument.value, VariableNode):
+                    return self._variables.get(argument.value.name.value)
+                return value_from_ast_untyped(argument.value, self._variables)
+        return None
+
+    def _page_size(self, node: FieldNode) -> int:
+        size = self._argument(node, "first")
+        if size is None:
+            size = self._argument(node, "last")
+        if size is None:
+            size = self._conf.default_page_size
+        return max(0, min(int(size), self._conf.pagination_limit))
+
+    def visit(self, parent: GraphQLNamedType, selection_set: SelectionSetNode | None, multiplier: int, depth: int) -> None:
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                self._visit_field(parent, selection, multiplier, depth)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = self._schema.get_type(selection.type_condition.name.value) if selection.type_condition else parent
+                self.visit(fragment_type, selection.selection_set, multiplier, depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = self._fragments.get(selection.name.value)
+                if fragment is not None:
+                    self.visit(self._schema.get_type(fragment.type_condition.name.value), fragment.selection_set, multiplier, depth)
+
+    def _visit_field(self, parent: GraphQLNamedType, node: FieldNode, multiplier: int, depth: int) -> None:
+        name = node.name.value
+        if name.startswith("__") or not isinstance(parent, GraphQLObjectType) or name not in parent.fields:
+            return
+        field = parent.fields[name]
+        field_type = get_named_type(field.type)
+
+        depth += 1
+        self.depth = max(self.depth, depth)
+        default_weight = 0 if is_leaf_type(field_type) else 1
+        self.cost += self._conf.field_costs.get(f"{parent.name}.{name}", default_weight) * multiplier
+
+        if "first" in field.args or "last" in field.args:
+            multiplier *= self._page_size(node)
+        elif isinstance(get_nullable_type(field.type), GraphQLList) and "pageInfo" not in parent.fields:
+            # Connection edges are already counted by the connection's page size
+            multiplier *= self._conf.cost_list_size
+        self.visit(field_type, node.selection_set, multiplier, depth)
+
+
+class QueryCostLimiter(SchemaExtension):
+
+    """Rejects operations whose static cost or depth is over budget before they execute.
+
+    The limits are `GRAPHQL__MAX_QUERY_COST` and `GRAPHQL__MAX_QUERY_DEPTH`.
+    The computed cost and depth are reported in the response extensions.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._cost: QueryCost | None = None
+
+    def on_execute(self):
+        context = self.execution_context
+        document = context.graphql_document
+        operation = get_operation_ast(document, context.operation_name) if document else None
+        if operation is not None:
+            schema = context.schema._schema
+            fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+            self._cost = QueryCost(schema, fragments, context.variables, settings.graphql)
+            self._cost.visit(schema.get_root_type(operation.operation), operation.selection_set, 1, 0)
+
+            if self._cost.cost > settings.graphql.max_query_cost:
+                context.result = ExecutionResult(data=None, errors=[GraphQLError(
+                    f"Query cost {self._cost.cost} exceeds the maximum of {settings.graphql.max_query_cost}."
+                )])
+            elif self._cost.depth > settings.graphql.max_query_depth:
+                context.result = ExecutionResult(data=None, errors=[GraphQLError(
+                    f"Query depth {self._cost.depth} exceeds the maximum of {settings.graphql.max_query_depth}."
+                )])
+        yield
+
+    def get_results(self) -> dict[str, Any]:
+        if self._cost is None:
+            return {}
+        return {"cost": {"cost": self._cost.cost, "depth": self._cost.depth, "maximum": settings.graphql.max_query_cost}}
@@ -6,37 +6,55 @@ from uuid import UUID
 from fileshare.graphql.inputs import DateTimeRange, IntRange
 from fileshare.graphql.types import OrderDirection
 
-from sqlalchemy import desc, asc
+from sqlalchemy import ColumnElement, desc, asc
 from fileshare.database.models import File
 
+@strawberry.enum
+class SearchMode(Enum):
+    """An enum for the ways of matching the `search` filter against file names"""
+
+    WORDS     = "words"      # Every word, as full words (`plainto_tsquery`)
+    PREFIX    = "prefix"     # Every word, as a word or the start of one (`to_tsquery` with `:*`)
+    SUBSTRING = "substring"  # The text anywhere in the name (`pg_trgm`)
+
 @strawberry.input
 class FileFilterInput:
     id:                list[UUID] | None = None
     name:               list[str] | None = None
     search:                   str | None = None
+    search_mode:       SearchMode = SearchMode.WORDS
     created:        DateTimeRange | None = None
     updated:        DateTimeRange | None = None
     active:                  bool | None = None
     share_count:         IntRange | None = None
     download_count:      IntRange | None = None
 
+# Every sort ends with the primary key so that keyset pages are totally
+# ordered, and each has a matching composite index on `file`. RELEVANCE
+# sorts by how well files match the `search` filter, and is ranked after the
+# search narrowed the files down through its own index.
 @strawberry.enum
 class FileSortField(Enum):
-    FILE_NAME      = ["object_name", "updated", "created"]
-    CREATED        = ["created", "updated"]
-    UPDATED        = ["updated", "created"]
-    SHARE_COUNT    = ["share_count", "updated", "created"]
-    DOWNLOAD_COUNT = ["download_count", "updated", "created"]
+    RELEVANCE      = ["relevance", "id"]
+    FILE_NAME      = ["object_name", "updated", "created", "id"]
+    CREATED        = ["created", "updated", "id"]
+    UPDATED        = ["updated", "created", "id"]
+    SHARE_COUNT    = ["share_count", "updated", "created", "id"]
+    DOWNLOAD_COUNT = ["download_count", "updated", "created", "id"]
 
 @strawberry.input
 class FileSortInput:
     direction: OrderDirection
     field: FileSortField
 
-    @property
-    def items(self):
+    def items_for(self, relevance: ColumnElement[float] | None = None):
+        """The ordering, with `relevance` standing in for the "relevance" column"""
         args = []
         order = desc if self.direction.value == "desc" else asc
         for col in self.field.value:
-            args.append(order(getattr(File, col)))
+            args.append(order(relevance if col == "relevance" else getattr(File, col)))
         return args
+
+    @property
+    def items(self):
+        return self.items_for()
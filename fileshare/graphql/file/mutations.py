@@ -1,17 +1,61 @@
+import asyncio
 from uuid import UUID
-from sqlalchemy import select
+from sqlalchemy import delete
 import strawberry
 from strawberry.types import Info
 from strawberry.file_uploads import Upload
 from asyncpg.exceptions import UniqueViolationError
 from sqlalchemy.exc import IntegrityError
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
 
+from fileshare.settings import settings
 from fileshare.database.engine import get_session
 from fileshare.database.models import File
-from fileshare.storage.minio import FileDeleteError, storage
+from fileshare.storage.minio import BucketDoesNotExist, FileDeleteError, FilePutError, storage
 
+from fileshare.graphql.context import mark_written, request_session
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.graphql.share.cache import share_cache
 from fileshare.graphql.file.types import AddFileError, AddFilesResult, FileType, RemoveFileError, RemoveFilesResult
-from fileshare.storage.minio import FilePutError
+
+
+async def add_file(name: str, file: Upload) -> FileType | AddFileError:
+    """Adds a single uploaded file to the database and the storage backend.
+
+    Uses its own session rather than the request's, so that several files can
+    be added concurrently.
+    """
+    async with get_session() as session:
+        try:
+            db_file = File(object_name=name, active=True)
+            session.add(db_file)
+            await session.flush()
+            await session.refresh(db_file)
+            await storage.put(name, file.file, file.size) # noqa
+            out = FileType.from_instance(db_file)
+            await session.commit()
+            return out
+        except (FilePutError, S3Error, HTTPError, BucketDoesNotExist) as e:
+            print(e)
+            await session.rollback()
+            return AddFileError(
+                code="add_files_storage_error",
+                message=f"Could not add '{name}': storage backend failure."
+            )
+        except IntegrityError as e:
+            await session.rollback()
+            if isinstance(e.orig.__cause__, UniqueViolationError):
+                return AddFileError(
+                    code="add_files_database_unique_violation_error",
+                    message=f"Could not add '{name}': file already exists in database."
+                )
+            else:
+                print(e)
+                return AddFileError(
+                    code="add_files_unknown_error",
+                    message=f"Could not add '{name}': unknown database integrity error."
+                )
 
 
 @strawberry.type
@@ -26,46 +70,29 @@ class FileMutation:
         files: list[Upload]
         ) -> AddFilesResult:
 
-        added: list[FileType] = []
-        errors : list[AddFileError] = []
-
-        for file in files:
-            async with get_session() as session:
-                name = prefix + file.filename # noqa
-                try:
-                    db_file = File(object_name=name, active=True)
-                    session.add(db_file)
-                    await session.flush()
-                    await session.refresh(db_file)
-                    storage.put(name, file.file, file.size) # noqa
-                    added.append(FileType.from_instance(db_file))
-                    await session.commit()
-                except FilePutError as e:
-                    errors.append(
-                        AddFileError(
-                            code="add_files_storage_error",
-                            message=f"Could not add '{name}': storage backend failure."
-                        )
-                    )
-                    print(e)
-                    await session.rollback()
-                except IntegrityError as e:
-                    if isinstance(e.orig.__cause__, UniqueViolationError):
-                        errors.append(
-                            AddFileError(
-                                code="add_files_database_unique_violation_error",
-                                message=f"Could not add '{name}': file already exists in database."
-                            )
-                        )
-                    else:
-                        errors.append(
-                            AddFileError(
-                                code="add_files_unknown_error",
-                                message=f"Could not add '{name}': unknown database integrity error."
-                            )
-                        )
-                        print(e)
-                    await session.rollback()
+        semaphore = asyncio.Semaphore(settings.graphql.upload_concurrency)
+
+        async def bounded_add_file(file: Upload) -> FileType | AddFileError:
+            async with semaphore:
+                return await add_file(prefix + file.filename, file) # noqa
+
+        # add_file turns every expected failure into an AddFileError, so an
+        # exception here is a bug; the remaining uploads are cancelled rather
+        # than left running against spool files that are about to be closed
+        tasks = [asyncio.create_task(bounded_add_file(file)) for file in files]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        added: list[FileType] = [r for r in results if isinstance(r, FileType)]
+        errors : list[AddFileError] = [r for r in results if isinstance(r, AddFileError)]
+        if added:
+            mark_written(info.context["response"])
+            await invalidate_responses("file")
         return AddFilesResult(added=added, errors=errors)
 
     @strawberry.mutation
@@ -77,7 +104,7 @@ class FileMutation:
         ids: list[UUID] | None = None,
         ) -> RemoveFilesResult:
 
-        async with get_session() as session:
+        async with request_session(info, write=True) as session:
             removed: list[FileType] = []
             errors: list[RemoveFileError] = []
 
@@ -86,32 +113,50 @@ class FileMutation:
                     for _ in ids + filenames:
                         errors.append(RemoveFileError(code="remove_files_malformed_request", message="Files can only be removed by ID or by filename, not both."))
                     return RemoveFilesResult(removed=removed, errors=errors)
-                files_query = select(File).filter(File.object_name.in_((*(prefix + name for name in filenames),)))
+                files_query = delete(File).filter(File.object_name.in_((*(prefix + name for name in filenames),)))
             elif ids:
-                files_query = select(File).filter(File.id.in_(ids))
+                files_query = delete(File).filter(File.id.in_(ids))
             else:
                 errors.append(RemoveFileError(code="remove_files_malformed_request", message="Files must be removed by ID or filename."))
                 return RemoveFilesResult(removed=removed, errors=errors)
-            result = await session.execute(files_query)
-            files = result.scalars().all()
-
-            for file in files:
-                await session.delete(file)
-                try:
-                    storage.delete([str(file.object_name)])
-                except FileDeleteError as e:
-                    errors = [
-                        RemoveFileError(
-                            code="remove_files_storage_backend_error",
-                            message=f"Could not remove file '{filename}' from storage backend."
-                        ) for filename in e.filenames
-                    ]
-                    await session.rollback()
-                removed.append(FileType.from_instance(file))
-                await session.commit()
+
+            savepoint = await session.begin_nested()
+            result = await session.execute(
+                files_query.returning(File).execution_options(synchronize_session=False)
+            )
+            files = {str(file.object_name): FileType.from_instance(file) for file in result.scalars().all()}
+
+            # The bucket is cleared with one remove_objects call, which minio
+            # sends as one multi-object delete request per 1000 keys.
+            deleted = files
+            try:
+                await storage.delete(list(files))
+            except FileDeleteError as e:
+                failed = set(e.filenames)
+                errors.extend(
+                    RemoveFileError(
+                        code="remove_files_storage_backend_error",
+                        message=f"Could not remove file '{filename}' from storage backend."
+                    ) for filename in failed
+                )
+                # Restore the rows of the objects which are still in the bucket
+                await savepoint.rollback()
+                deleted = {name: file for name, file in files.items() if name not in failed}
+                if deleted:
+                    await session.execute(
+                        delete(File)
+                        .filter(File.id.in_([file.id for file in deleted.values()]))
+                        .execution_options(synchronize_session=False)
+                    )
+            removed.extend(deleted.values())
+            await session.commit()
+            await share_cache.invalidate(file_ids=[file.id for file in removed])
+            if removed:
+                await invalidate_responses("file", "share")
+
             if filenames:
                 for filename in filenames:
-                    if prefix+filename not in list(map(lambda f: str(f.object_name), files)):
+                    if prefix+filename not in files:
                         errors.append(
                             RemoveFileError(
                                 code="remove_files_file_not_found",
@@ -119,8 +164,9 @@ class FileMutation:
                             )
                         )
             elif ids:
+                found = {file.id for file in files.values()}
                 for i in ids:
-                    if i not in list(map(lambda f: f.id, files)):
+                    if i not in found:
                         errors.append(
                             RemoveFileError(
                                 code="remove_files_file_not_found",
@@ -1,15 +1,20 @@
+import re
 from typing import Tuple
-from sqlalchemy import Select, select
+from functools import partial
+from sqlalchemy import ColumnElement, Select, String, case, cast, literal, select, true
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from sqlalchemy.sql import func
 import strawberry
 from uuid import UUID
 from strawberry.types import Info
 
-from fileshare.database.engine import get_session
+from fileshare.settings import settings
 from fileshare.database.models import File
-from fileshare.graphql.file.inputs import FileFilterInput, FileSortField, FileSortInput
-from fileshare.graphql.file.types import FileType, FileNotFoundError
-from fileshare.graphql.helpers import get_countable_connection
+from fileshare.graphql.context import request_session
+from fileshare.graphql.cursors import CursorDecodeError, decode_cursor
+from fileshare.graphql.file.inputs import FileFilterInput, FileSortField, FileSortInput, SearchMode
+from fileshare.graphql.file.types import BrowseEntryType, FileType, FileNotFoundError
+from fileshare.graphql.helpers import get_countable_connection, sort_spec
 from fileshare.graphql.types import CountableConnection, OrderDirection, PaginationError
 
 
@@ -32,16 +37,124 @@ def apply_file_filters(q: Select[Tuple[File]], filters: FileFilterInput | None)
         q = q.filter(File.updated.between(filters.updated.gte, filters.updated.lte))
     if filters.active is not None:
         q = q.filter(File.active == filters.active)
-    if filters.search is not None:
-        q = q.filter(File.tsvector.bool_op("@@")(func.plainto_tsquery(filters.search)))
+    if (search := file_search(filters)) is not None:
+        q = q.filter(search[0])
     return q
 
-def apply_file_sort(q: Select[Tuple[File]], sort: FileSortInput | None) -> Select[Tuple[File]]:
+def file_search(filters: FileFilterInput | None) -> tuple[ColumnElement[bool], ColumnElement[float]] | None:
+    """Returns the condition matching the search filter and the relevance of each match"""
+    if not filters or filters.search is None:
+        return None
+
+    if filters.search_mode == SearchMode.SUBSTRING:
+        # Served by the trigram index, and ranked by trigram similarity
+        return File.object_name.icontains(filters.search, autoescape=True), func.similarity(File.object_name, filters.search)
+
+    if filters.search_mode == SearchMode.PREFIX:
+        # Words are reduced to letters and digits, so they can't inject tsquery operators
+        words = re.findall(r"[^\W_]+", filters.search)
+        tsquery = func.to_tsquery(cast(literal("english"), REGCONFIG), " & ".join(f"{word}:*" for word in words))
+    else:
+        tsquery = func.plainto_tsquery(cast(literal("english"), REGCONFIG), filters.search)
+    return File.tsvector.bool_op("@@")(tsquery), func.ts_rank(File.tsvector, tsquery)
+
+def apply_file_sort(q: Select[Tuple[File]], sort: FileSortInput | None, filters: FileFilterInput | None = None) -> Select[Tuple[File]]:
     if not sort:
         sort = FileSortInput(direction=OrderDirection.DESC, field=FileSortField.UPDATED)
 
+    if sort.field == FileSortField.RELEVANCE:
+        search = file_search(filters)
+        if search is None:
+            # Without a search every file is as relevant as the next
+            sort = FileSortInput(direction=sort.direction, field=FileSortField.UPDATED)
+        else:
+            return q.order_by(*sort.items_for(search[1]))
+
     return q.order_by(*sort.items)
 
+def prefix_upper_bound(prefix: str) -> str | None:
+    """Returns the least string (byte-wise) greater than every string starting with `prefix`, if any"""
+    for i in reversed(range(len(prefix))):
+        c = ord(prefix[i]) + 1
+        if 0xD800 <= c < 0xE000:
+            # Surrogates can't be encoded
+            c = 0xE000
+        if c <= 0x10FFFF:
+            return prefix[:i] + chr(c)
+    return None
+
+def browse_query(prefix: str, after: str | None = None, before: str | None = None, limit: int | None = None) -> Select[Tuple[str, int, str | None]]:
+    """Lists the immediate children of `prefix` in byte-wise order.
+
+    A child is a folder (its name up to and including the next "/") or a
+    file. Rows are (child, file count, file ID for a file child). The
+    children are found by a skip scan of `idx_file_object_name_c`: each step
+    probes the index once for the first name past the previous child, so a
+    page of `limit` children costs `limit` probes plus counting the files of
+    its folders, however many files lie elsewhere below the prefix. The walk
+    starts past the child `after`, or walks backwards from the child `before`.
+    """
+    name = File.object_name.collate("C")
+    in_prefix = [name >= prefix]
+    if (upper := prefix_upper_bound(prefix)) is not None:
+        in_prefix.append(name < upper)
+
+    def split(object_name):
+        """Returns the child of `prefix` which `object_name` is below, whether it is a folder, and where the folder ends"""
+        rest = func.substr(object_name, len(prefix) + 1)
+        slash = func.strpos(rest, "/")
+        # "0" is the character after "/", so no name in the folder reaches it
+        return case((slash > 0, func.substr(rest, 1, slash)), else_=rest), slash > 0, literal(prefix) + func.substr(rest, 1, slash - 1) + "0"
+
+    def past(object_name):
+        """Returns the least name of the next child after the one `object_name` is below"""
+        _, is_folder, folder_end = split(object_name)
+        # Text can not hold NUL, so nothing sorts between a name and itself + "\x01"
+        return case((is_folder, folder_end), else_=object_name + "\x01")
+
+    def first_name(*bounds):
+        return (
+            select(File.object_name.label("name"), File.id.label("id"))
+            .filter(*in_prefix, *bounds)
+            .order_by(name.desc() if before is not None else name)
+            .limit(1)
+        )
+
+    if before is not None:
+        start = first_name(name < prefix + before)
+    elif after is not None:
+        start = first_name(name >= past(literal(prefix + after)))
+    else:
+        start = first_name()
+    start = start.subquery()
+    walk = select(start.c.name, start.c.id, literal(1).label("n")).cte("browse_walk", recursive=True)
+
+    if before is not None:
+        step = first_name(name < literal(prefix) + split(walk.c.name)[0])
+    else:
+        step = first_name(name >= past(walk.c.name))
+    step = step.lateral()
+    following = select(step.c.name, step.c.id, walk.c.n + 1).select_from(walk.join(step, true()))
+    if limit is not None:
+        following = following.filter(walk.c.n < limit)
+    walk = walk.union_all(following)
+
+    child, is_folder, folder_end = split(walk.c.name)
+    child = child.collate("C").label("child")
+    folder_files = select(func.count()).filter(name >= literal(prefix) + child, name < folder_end).scalar_subquery()
+    file_count = case((is_folder, folder_files), else_=1).label("file_count")
+    file_id = case((is_folder, None), else_=cast(walk.c.id, String)).label("file_id")
+    return select(child, file_count, file_id).order_by(child)
+
+def browse_cursor_child(cursor: str | None, spec: str) -> str | None:
+    """Decodes a browse cursor into the child it points at"""
+    if cursor is None:
+        return None
+    place = decode_cursor(cursor, spec)
+    if len(place) != 1 or not isinstance(place[0], str):
+        raise CursorDecodeError("Cursor does not point at a browse entry.")
+    return place[0]
+
 
 @strawberry.type
 class FileQuery:
@@ -54,7 +167,7 @@ class FileQuery:
         id: UUID
     ) -> FileType | FileNotFoundError:
 
-        async with get_session() as session:
+        async with request_session(info) as session:
             file_query = select(File).filter(File.id == id)
             result = await session.execute(file_query)
             file = result.scalar()
@@ -76,11 +189,44 @@ class FileQuery:
         last: int | None = None
     ) -> CountableConnection[FileType] | PaginationError:
 
-        async with get_session() as session:
+        async with request_session(info) as session:
 
             files_query = select(File)
             if filter is not None:
                 files_query = apply_file_filters(files_query, filter)
-            files_query = apply_file_sort(files_query, sort)
+            files_query = apply_file_sort(files_query, sort, filter)
+
+            return await get_countable_connection(session, files_query, FileType.from_instance, before, after, first, last, info)
+
+    @strawberry.field
+    async def browse(
+        self,
+        info: Info,
+        prefix: str = "",
+        after: str | None = None,
+        first: int | None = None,
+        before: str | None = None,
+        last: int | None = None
+    ) -> CountableConnection[BrowseEntryType] | PaginationError:
+
+        # The cursor and page size bound the walk over the children, so only
+        # the page's own children are visited; totalCount walks them all
+        count_query = browse_query(prefix)
+        try:
+            spec = sort_spec(count_query)
+            after_child, before_child = browse_cursor_child(after, spec), browse_cursor_child(before, spec)
+        except CursorDecodeError:
+            return PaginationError(code="cursor_invalid", message="Cursor could not be deserialized.")
+        size = (last if before is not None else first) or settings.graphql.default_page_size
+        # One more than the page, which tells whether there is another page
+        limit = min(max(size, 0), settings.graphql.pagination_limit) + 1
+        page_query = browse_query(prefix, after_child, before_child if after_child is None else None, limit)
 
-            return await get_countable_connection(session, files_query, FileType.from_instance, before, after, first, last)
+        async with request_session(info) as session:
+            return await get_countable_connection(
+                session,
+                page_query,
+                partial(BrowseEntryType.from_row, prefix),
+                before, after, first, last, info,
+                count_query=count_query
+            )
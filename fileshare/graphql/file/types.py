@@ -1,5 +1,3 @@
-from sqlalchemy import select
-from sqlalchemy.orm import query
 import strawberry
 from uuid import UUID
 from datetime import datetime
@@ -7,8 +5,7 @@ from typing import Annotated, TYPE_CHECKING
 
 from strawberry.types import Info
 
-from fileshare.database.engine import get_session
-from fileshare.database.models import File, Share
+from fileshare.database.models import File
 from fileshare.graphql.types import ErrorType
 
 if TYPE_CHECKING:
@@ -17,11 +14,8 @@ if TYPE_CHECKING:
 
 async def resolve_shares(root: "FileType", info: Info) -> list[Annotated["ShareType", strawberry.lazy("fileshare.graphql.share.types")]]:
     from fileshare.graphql.share.types import ShareType
-    async with get_session() as session:
-        query_shares = select(Share).filter(Share.file_id==root.id)
-        result = await session.execute(query_shares)
-        shares = result.scalars().all()
-        return [ShareType.from_instance(s) for s in shares]
+    shares = await info.context["loaders"].shares_by_file.load(root.id)
+    return [ShareType.from_instance(s) for s in shares]
 
 @strawberry.type
 class FileType:
@@ -46,6 +40,32 @@ class FileType:
             download_count=instance.download_count
         )
 
+async def resolve_browse_file(root: "BrowseEntryType", info: Info) -> FileType | None:
+    if root.file_id is None:
+        return None
+    file = await info.context["loaders"].file.load(root.file_id)
+    return FileType.from_instance(file) if file else None
+
+@strawberry.type
+class BrowseEntryType:
+    """An immediate child of a browsed prefix: a folder (whose name ends with
+    "/") holding `file_count` files at any depth, or a single file"""
+
+    name: str
+    is_folder: bool
+    file_count: int
+    file_id: strawberry.Private[UUID | None]
+    file: FileType | None = strawberry.field(resolver=resolve_browse_file)
+
+    @classmethod
+    def from_row(cls, prefix: str, child: str, file_count: int, file_id: str | None):
+        return cls(
+            name=prefix + child,
+            is_folder=child.endswith("/"),
+            file_count=file_count,
+            file_id=UUID(file_id) if file_id is not None else None
+        )
+
 @strawberry.type
 class FileNotFoundError(ErrorType):
     pass
@@ -1,33 +1,127 @@
-import binascii
-from base64 import b64encode, b64decode
-from sqlakeyset import BadBookmark, unserialize_bookmark
+import json
+import asyncio
+from sqlakeyset import BadBookmark
 from sqlakeyset.asyncio import select_page
 
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, Iterable, Iterator, Tuple
 from sqlakeyset.sqla import AsyncSession
 
-from sqlalchemy import Select
+from sqlalchemy import Select, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from graphql import GraphQLError
+from strawberry.types import Info
+from strawberry.types.nodes import FragmentSpread, InlineFragment, SelectedField
 
 from fileshare.settings import settings
-from fileshare.graphql.types import CountableConnection, Edge, PageInfo, PaginationError
+from fileshare.database.engine import get_session
+from fileshare.graphql.cursors import CursorDecodeError, decode_cursor, encode_cursor
+from fileshare.graphql.types import CountableConnection, CountStrategy, Edge, PageInfo, PaginationError, TotalCount, count_key
 
 
-class CursorB64DecodeError(Exception):
-    """An exception to be raised when a cursor passed is invalid b64"""
-    pass
+def sort_spec(query: Select[Tuple[Any]]) -> str:
+    """Describes the ordering of a query, to tie cursors to the sort they came from"""
+    return ",".join(str(clause) for clause in query._order_by_clauses)
 
-def to_b64(cursor: str) -> str:
-    """Encodes a cursor string as base64"""
-    return b64encode(cursor.encode("utf-8")).decode("ascii")
+class Explain(Executable, ClauseElement):
+    """An `EXPLAIN (FORMAT JSON)` of a statement"""
 
-def from_b64(cursor: str) -> str:
-    """Decodes a base64 cursor string"""
-    try:
-        return b64decode(cursor.encode("ascii")).decode("utf-8")
-    except binascii.Error:
-        raise CursorB64DecodeError(f"Cursor '{cursor}' is not a valid b64-encoded string.")
+    inherit_cache = False
+
+    def __init__(self, statement: Select[Any]) -> None:
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def compile_explain(element: Explain, compiler, **kw) -> str:
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+def find_selected_fields(selections: Iterable[Any], name: str) -> Iterator[SelectedField]:
+    """Finds every selection of a field by name (under any alias), looking into fragments"""
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            if selection.name == name:
+                yield selection
+        elif isinstance(selection, (FragmentSpread, InlineFragment)):
+            yield from find_selected_fields(selection.selections, name)
+
+async def count_total(query: Select[Tuple[Any]], strategy: CountStrategy, cap: int, replica: bool = True) -> TotalCount:
+    """Counts the result set of a query using the given strategy.
+
+    Runs in its own session, so it can run alongside the page query. The
+    session reads from a replica when `replica` is set and one is usable.
+    """
+    query = query.order_by(None)
+    async with get_session(read_only=replica) as session:
+        if strategy == CountStrategy.ESTIMATE:
+            plan = (await session.execute(Explain(query))).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return TotalCount(count=int(plan[0]["Plan"]["Plan Rows"]), capped=False, estimated=True)
+        if strategy == CountStrategy.CAPPED:
+            count = (await session.execute(select(func.count()).select_from(query.limit(cap + 1).subquery()))).scalar()
+            return TotalCount(count=min(count, cap), capped=count > cap, estimated=False)
+        count = (await session.execute(select(func.count()).select_from(query.subquery()))).scalar()
+        return TotalCount(count=count, capped=False, estimated=False)
+
+def start_total_counts(query: Select[Tuple[Any]], info: Info | None) -> dict[Tuple[CountStrategy, int | None], asyncio.Task]:
+    """Starts counting the result set once for each distinct `totalCount` selection.
+
+    Selections with a negative cap are skipped; their resolver reports the error.
+    """
+    tasks: dict[Tuple[CountStrategy, int | None], asyncio.Task] = {}
+    if info is None:
+        return tasks
+    fields = find_selected_fields(
+        (selection for selected in info.selected_fields for selection in selected.selections),
+        "totalCount"
+    )
+    replica = not info.context["session"].reads_primary
+    for field in fields:
+        # Literal arguments are given as their source text, e.g. "1000"
+        cap = field.arguments.get("cap")
+        try:
+            key = count_key(field.arguments.get("strategy"), int(cap) if cap is not None else None)
+        except GraphQLError:
+            continue
+        if key not in tasks:
+            strategy, cap = key
+            tasks[key] = asyncio.create_task(count_total(query, strategy, cap if cap is not None else 0, replica))
+            # Left to the context to cancel if the resolver never awaits it
+            info.context["tasks"].add(tasks[key])
+    return tasks
 
 async def get_countable_connection(
+    session: AsyncSession,
+    query: Select[Tuple[Any]],
+    resolve_node: Callable,
+    before: str | None = None,
+    after: str | None = None,
+    first: int | None = None,
+    last: int | None = None,
+    info: Info | None = None,
+    count_query: Select[Tuple[Any]] | None = None,
+    ) -> CountableConnection[Any] | PaginationError:
+    """Fetches a page of the query, counting the whole result set alongside if requested.
+
+    `count_query` is counted instead of `query` when the query is already
+    restricted to the page.
+    """
+    total_count_tasks = start_total_counts(count_query if count_query is not None else query, info)
+    try:
+        connection = await _get_page_connection(session, query, resolve_node, before, after, first, last)
+    except BaseException:
+        for task in total_count_tasks.values():
+            task.cancel()
+        raise
+    if isinstance(connection, PaginationError):
+        for task in total_count_tasks.values():
+            task.cancel()
+    else:
+        connection.total_count_tasks = total_count_tasks
+    return connection
+
+async def _get_page_connection(
     session: AsyncSession,
     query: Select[Tuple[Any]],
     resolve_node: Callable,
@@ -37,6 +131,8 @@ async def get_countable_connection(
     last: int | None = None,
     ) -> CountableConnection[Any] | PaginationError:
 
+    spec = sort_spec(query)
+
     if after is not None:
         if before is not None:
             return PaginationError(code="paging_direction_conflict", message="Results can only be fetched before OR after a cursor, not both.")
@@ -51,9 +147,9 @@ async def get_countable_connection(
                 session,
                 query,
                 per_page=first,
-                after=unserialize_bookmark(from_b64(after)).place
+                after=decode_cursor(after, spec)
             )
-        except (BadBookmark, CursorB64DecodeError) :
+        except (BadBookmark, CursorDecodeError):
             return PaginationError(code="cursor_invalid", message=f"Cursor could not be deserialized.")
 
     elif before is not None:
@@ -70,9 +166,9 @@ async def get_countable_connection(
                 session,
                 query,
                 per_page=last,
-                before=unserialize_bookmark(from_b64(before)).place
+                before=decode_cursor(before, spec)
             )
-        except BadBookmark:
+        except (BadBookmark, CursorDecodeError):
             return PaginationError(code="cursor_invalid", message="Cursor could not be deserialized.")
 
     else:
@@ -93,20 +189,20 @@ async def get_countable_connection(
             return PaginationError(code="cursor_invalid", message=f"Cursor could not be deserialized.")
 
 
-    bookmark_items = list(page.paging.bookmark_items())
+    edges = [
+        Edge(
+            node=resolve_node(*row),
+            cursor=encode_cursor(place, spec)
+        ) for (place, _), row in page.paging.items()
+    ]
 
     return CountableConnection(
         count=len(page),
         page_info=PageInfo(
             has_next_page=page.paging.has_next,
             has_previous_page=page.paging.has_previous,
-            start_cursor=to_b64(bookmark_items[0][0]) if bookmark_items else None,
-            end_cursor=to_b64(bookmark_items[-1][0]) if bookmark_items else None
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None
         ),
-        edges=[
-            Edge(
-                node=resolve_node(node),
-                cursor=to_b64(bookmark)
-            ) for bookmark, (node,) in bookmark_items
-        ]
+        edges=edges
     )
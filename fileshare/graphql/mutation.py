@@ -1,9 +1,11 @@
 import strawberry
+from fileshare.graphql.download.mutations import DownloadMutation
 from fileshare.graphql.file.mutations import FileMutation
 from fileshare.graphql.share.mutations import ShareMutation
+from fileshare.graphql.upload.mutations import UploadMutation
 
 @strawberry.type
-class Mutation(FileMutation, ShareMutation):
+class Mutation(FileMutation, ShareMutation, DownloadMutation, UploadMutation):
     @strawberry.field
     def ping(self) -> str:
         return "pong"
@@ -0,0 +1,128 @@
+import hashlib
+from typing import Any
+
+from graphql import DocumentNode, ExecutionResult, GraphQLError
+from strawberry.extensions import SchemaExtension
+from strawberry.fastapi import GraphQLRouter
+
+from fileshare.cache import TTLCache
+from fileshare.settings import settings
+
+# Stands in for the query of a request whose persisted query hash is unknown,
+# so that the request is answered with a `PersistedQueryNotFound` error.
+NOT_FOUND_QUERY = "query PersistedQueryNotFound { __typename }"
+
+
+def query_hash(query: str) -> str:
+    """Returns the hex SHA-256 hash identifying a query"""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+# Query text by hash, for Automatic Persisted Queries
+persisted_queries: TTLCache[str, str] = TTLCache(maxsize=settings.graphql.persisted_query_cache_size)
+
+# Parsed documents and their validation errors by query hash
+documents: TTLCache[str, DocumentNode] = TTLCache(maxsize=settings.graphql.document_cache_size)
+validations: TTLCache[str, list[GraphQLError]] = TTLCache(maxsize=settings.graphql.document_cache_size)
+
+
+def cache_stats() -> dict[str, Any]:
+    """Reports the persisted query and document caches"""
+    return {
+        "persisted_queries": persisted_queries.stats(),
+        "documents": documents.stats(),
+        "validations": validations.stats(),
+    }
+
+
+class PersistedQueryRouter(GraphQLRouter):
+
+    """A GraphQL router supporting Automatic Persisted Queries.
+
+    Requests with a `persistedQuery` extension may omit the query text and send
+    only its SHA-256 hash. If the hash is unknown the response is a
+    `PersistedQueryNotFound` error, and the client retries with the full text,
+    which is then remembered under its hash.
+    """
+
+    def should_render_graphiql(self, request: Any) -> bool:
+        # A GET of a persisted query has no `query` parameter either
+        return "extensions" not in request.query_params and super().should_render_graphiql(request)
+
+    async def parse_extensions(self, request: Any) -> dict[str, Any]:
+        """Reads the `extensions` of a JSON body or of GET query parameters.
+
+        Strawberry's `GraphQLRequestData` drops them, so they are parsed from
+        the request itself.
+        """
+        content_type = request.content_type or ""
+        if "application/json" in content_type:
+            body = self.parse_json(await request.get_body())
+            extensions = body.get("extensions") if isinstance(body, dict) else None
+        elif request.method == "GET":
+            extensions = request.query_params.get("extensions")
+        else:
+            return {}
+        if isinstance(extensions, (str, bytes)):
+            extensions = self.parse_json(extensions)
+        return extensions if isinstance(extensions, dict) else {}
+
+    async def parse_http_body(self, request: Any) -> Any:
+        data = await super().parse_http_body(request)
+        persisted = (await self.parse_extensions(request)).get("persistedQuery")
+        if not isinstance(persisted, dict) or persisted.get("version") != 1 or not (sha256 := persisted.get("sha256Hash")):
+            return data
+
+        if data.query:
+            if query_hash(data.query) == sha256:
+                persisted_queries.set(sha256, data.query)
+        elif (query := persisted_queries.get(sha256)) is not None:
+            data.query = query
+        else:
+            data.query = NOT_FOUND_QUERY
+        return data
+
+
+class DocumentCache(SchemaExtension):
+
+    """Caches parsed and validated documents by the SHA-256 hash of their query.
+
+    Repeated operations skip both parsing and validation. Hits and misses are
+    counted on the `documents` and `validations` caches.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._hash: str | None = None
+
+    def on_parse(self):
+        context = self.execution_context
+        if context.query and context.graphql_document is None:
+            self._hash = query_hash(context.query)
+            context.graphql_document = documents.get(self._hash)
+        yield
+        if self._hash is not None and context.graphql_document is not None:
+            documents.set(self._hash, context.graphql_document)
+
+    def on_validate(self):
+        context = self.execution_context
+        # Validation can only be skipped through `ExecutionContext.errors`,
+        # which newer strawberry releases no longer have
+        if not hasattr(context, "errors"):
+            yield
+            return
+        if self._hash is not None and context.errors is None:
+            cached = validations.get(self._hash)
+            if cached is not None:
+                context.errors = list(cached)
+        yield
+        if self._hash is not None and context.errors is not None:
+            validations.set(self._hash, list(context.errors))
+
+    def on_execute(self):
+        if self.execution_context.query == NOT_FOUND_QUERY:
+            self.execution_context.result = ExecutionResult(data=None, errors=[GraphQLError(
+                "PersistedQueryNotFound",
+                extensions={"code": "PERSISTED_QUERY_NOT_FOUND"}
+            )])
+        yield
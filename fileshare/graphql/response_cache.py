@@ -0,0 +1,175 @@
+import json
+from abc import ABC, abstractmethod
+import time
+import hashlib
+from typing import Any
+
+from graphql import ExecutionResult, FieldNode, OperationType, get_operation_ast, print_ast
+
+from strawberry.extensions import SchemaExtension
+
+from fileshare.cache import TTLCache
+from fileshare.settings import settings
+from fileshare.database.engine import replicas
+from fileshare.invalidation import InvalidationBus, Message, invalidation_bus
+
+CHANNEL = "fileshare_versions"
+TABLES = ("file", "share")
+
+
+class ResponseCacheBackend(ABC):
+
+    """Storage for cached query responses and the table versions they depend on.
+
+    Every mutation bumps the version of the tables it changes. Responses are
+    stored under keys which include the versions of the tables they read, so
+    once a version is bumped the stale responses can no longer be found.
+
+    Methods:
+        get(key) -- Returns the cached response data for `key`, or None.
+
+        set(key, data, ttl) -- Caches response data for `ttl` seconds.
+
+        versions(tables) -- Returns the current versions of the tables.
+
+        bump(tables) -- Increments the versions of the tables.
+
+        bumped_within(tables, seconds) -- Whether any of the tables' versions
+            was bumped in the last `seconds` seconds.
+
+    A backend shared between workers subclasses this and implements every
+    method; one which leaves any out can not be instantiated.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> dict[str, Any] | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, data: dict[str, Any], ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def versions(self, tables: tuple[str, ...]) -> list[int]:
+        ...
+
+    @abstractmethod
+    async def bump(self, tables: tuple[str, ...]) -> None:
+        ...
+
+    @abstractmethod
+    async def bumped_within(self, tables: tuple[str, ...], seconds: float) -> bool:
+        ...
+
+
+class MemoryResponseCacheBackend(ResponseCacheBackend):
+
+    """An in-process response cache backend.
+
+    Version bumps are relayed to the other workers over the invalidation bus.
+    """
+
+    def __init__(self, bus: InvalidationBus, maxsize: int) -> None:
+        self._responses: TTLCache[str, dict[str, Any]] = TTLCache(maxsize=maxsize)
+        self._versions: dict[str, int] = {}
+        self._bumped: dict[str, float] = {}
+        self._bus = bus
+        self._bus.subscribe(CHANNEL, self._on_message)
+
+    def _on_message(self, message: Message) -> None:
+        if message.get("all"):
+            self._responses.clear()
+            return
+        for table in message.get("tables", []):
+            self._versions[table] = self._versions.get(table, 0) + 1
+            self._bumped[table] = time.monotonic()
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        return self._responses.get(key)
+
+    async def set(self, key: str, data: dict[str, Any], ttl: float) -> None:
+        self._responses.set(key, data, ttl=ttl)
+
+    async def versions(self, tables: tuple[str, ...]) -> list[int]:
+        return [self._versions.get(table, 0) for table in tables]
+
+    async def bump(self, tables: tuple[str, ...]) -> None:
+        await self._bus.publish(CHANNEL, {"tables": list(tables)})
+
+    async def bumped_within(self, tables: tuple[str, ...], seconds: float) -> bool:
+        now = time.monotonic()
+        return any(now - self._bumped[table] < seconds for table in tables if table in self._bumped)
+
+
+response_cache_backend: ResponseCacheBackend = MemoryResponseCacheBackend(invalidation_bus, settings.cache.response_cache_size)
+
+async def invalidate_responses(*tables: str) -> None:
+    """Invalidates cached responses reading the given tables; call after committing"""
+    if settings.cache.response_cache:
+        await response_cache_backend.bump(tables)
+
+
+# Normalized query text by raw query text
+normalized_queries: TTLCache[str, str] = TTLCache(maxsize=settings.graphql.document_cache_size)
+
+
+class ResponseCache(SchemaExtension):
+
+    """Caches the results of query operations, when enabled with `CACHE__RESPONSE_CACHE`.
+
+    An operation is cached only if every top-level field it selects has a TTL
+    in `CACHE__RESPONSE_CACHE_TTLS`, and then for the shortest of those TTLs.
+    Responses are keyed by the normalized document, operation name, variables
+    and the current versions of the `file` and `share` tables. Results with
+    errors are never cached, and neither are results which may have been read
+    from a replica shortly after a version was bumped, since the replica may
+    not have replayed the change yet.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._key: str | None = None
+        self._ttl: float | None = None
+
+    def _cache_ttl(self) -> float | None:
+        context = self.execution_context
+        if context.graphql_document is None:
+            return None
+        operation = get_operation_ast(context.graphql_document, context.operation_name)
+        if operation is None or operation.operation != OperationType.QUERY:
+            return None
+        ttls = []
+        for selection in operation.selection_set.selections:
+            if not isinstance(selection, FieldNode) or selection.name.value not in settings.cache.response_cache_ttls:
+                return None
+            ttls.append(settings.cache.response_cache_ttls[selection.name.value])
+        return min(ttls) if ttls else None
+
+    async def on_execute(self):
+        context = self.execution_context
+        if settings.cache.response_cache and context.result is None:
+            self._ttl = self._cache_ttl()
+        if self._ttl is not None and self._ttl > 0:
+            normalized = normalized_queries.get(context.query)
+            if normalized is None:
+                normalized = print_ast(context.graphql_document)
+                normalized_queries.set(context.query, normalized)
+            versions = await response_cache_backend.versions(TABLES)
+            self._key = hashlib.sha256(json.dumps(
+                [normalized, context.operation_name, context.variables, versions],
+                sort_keys=True,
+                default=str
+            ).encode("utf-8")).hexdigest()
+            data = await response_cache_backend.get(self._key)
+            if data is not None:
+                context.result = ExecutionResult(data=data)
+                self._key = None
+        yield
+        if self._key is not None and context.result is not None and not context.result.errors:
+            if not await self._maybe_stale():
+                await response_cache_backend.set(self._key, context.result.data, self._ttl)
+
+    async def _maybe_stale(self) -> bool:
+        """Whether the result may have been read from a replica which is behind the current versions"""
+        session = self.execution_context.context["session"]
+        return session.may_read_replica and await response_cache_backend.bumped_within(TABLES, replicas.max_staleness)
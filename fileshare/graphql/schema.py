@@ -1,9 +1,12 @@
 import strawberry
 
+from fileshare.graphql.context import get_context
+from fileshare.graphql.extensions import QueryCostLimiter
+from fileshare.graphql.persisted import DocumentCache, PersistedQueryRouter
+from fileshare.graphql.response_cache import ResponseCache
 from fileshare.graphql.query import Query
 from fileshare.graphql.mutation import Mutation
-from strawberry.fastapi import GraphQLRouter
 
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
-graphql_app = GraphQLRouter(schema)
+schema = strawberry.Schema(query=Query, mutation=Mutation, extensions=[DocumentCache, QueryCostLimiter, ResponseCache])
+graphql_app = PersistedQueryRouter(schema, context_getter=get_context)
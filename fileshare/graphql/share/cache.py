@@ -0,0 +1,107 @@
+import time
+from uuid import UUID
+
+from fileshare.cache import TTLCache
+from fileshare.settings import settings
+from fileshare.settings.cache import CacheSettings
+from fileshare.database.engine import replicas
+from fileshare.invalidation import InvalidationBus, Message, invalidation_bus
+from fileshare.graphql.share.types import ShareType
+
+CHANNEL = "fileshare_share"
+
+
+class ShareCache:
+
+    """An in-process cache of shares for lookups by ID or key.
+
+    Shares are stored by ID, and keys map to IDs. A key lookup is only a hit
+    if the share it maps to is cached and still has that key, so invalidating
+    a share's ID is enough to invalidate its key as well, even after the key
+    has been changed.
+
+    Every invalidation received advances `generation`. A reader takes the
+    generation before its query and passes it to `set`, which drops the share
+    if an invalidation arrived in between: the row read may predate the
+    change the invalidation announced. Shares read from a replica are not
+    cached shortly after an invalidation either, since the replica may not
+    have replayed the change yet.
+
+    Methods:
+        get(id, key) -- Returns the cached share matching the ID and/or key.
+
+        set(share, generation, from_replica) -- Caches a share read since
+            `generation`.
+
+        invalidate(ids, file_ids) -- Publishes an invalidation of the given
+            shares, and of all shares of the given files, on the bus.
+    """
+
+    def __init__(self, bus: InvalidationBus, conf: CacheSettings | None = None) -> None:
+        if not conf:
+            conf = settings.cache
+
+        self._ids: TTLCache[UUID, ShareType] = TTLCache(maxsize=conf.share_cache_size, ttl=conf.share_cache_ttl)
+        self._keys: TTLCache[str, UUID] = TTLCache(maxsize=conf.share_cache_size, ttl=conf.share_cache_ttl)
+        self._invalidated = float("-inf")
+        self._generation = 0
+        self._bus = bus
+        self._bus.subscribe(CHANNEL, self._on_message)
+
+    @property
+    def generation(self) -> int:
+        """The number of invalidations received so far"""
+        return self._generation
+
+    @property
+    def hits(self) -> int:
+        return self._ids.hits
+
+    @property
+    def misses(self) -> int:
+        return self._ids.misses
+
+    def get(self, id: UUID | None = None, key: str | None = None) -> ShareType | None:
+        """Returns the cached share with the given ID and/or key, if any"""
+        if id is None:
+            if key is None or (id := self._keys.get(key)) is None:
+                return None
+        share = self._ids.get(id)
+        if share is None or (key is not None and share.key != key):
+            return None
+        return share
+
+    def set(self, share: ShareType, generation: int, from_replica: bool = False) -> None:
+        """Caches a share by ID and key, unless it was invalidated since `generation`"""
+        if generation != self._generation:
+            return
+        if from_replica and time.monotonic() - self._invalidated < replicas.max_staleness:
+            return
+        self._ids.set(share.id, share)
+        self._keys.set(share.key, share.id)
+
+    def _on_message(self, message: Message) -> None:
+        self._invalidated = time.monotonic()
+        self._generation += 1
+        if message.get("all"):
+            self._ids.clear()
+            self._keys.clear()
+            return
+        for id in message.get("ids", []):
+            self._ids.pop(UUID(id))
+        if file_ids := set(message.get("file_ids", [])):
+            for id, share in self._ids.items():
+                if str(share.file_id) in file_ids:
+                    self._ids.pop(id)
+
+    async def invalidate(self, ids: list[UUID] | None = None, file_ids: list[UUID] | None = None) -> None:
+        """Invalidates shares (by ID or by file) in every worker's cache"""
+        if not ids and not file_ids:
+            return
+        await self._bus.publish(CHANNEL, {
+            "ids": [str(id) for id in ids or []],
+            "file_ids": [str(id) for id in file_ids or []],
+        })
+
+
+share_cache = ShareCache(invalidation_bus)
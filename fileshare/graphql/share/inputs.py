@@ -2,6 +2,7 @@ import strawberry
 
 from enum import Enum
 from uuid import UUID
+from datetime import datetime
 
 from fileshare.graphql.types import OrderDirection
 from fileshare.graphql.inputs import DateTimeRange, IntRange
@@ -20,13 +21,30 @@ class ShareFilterInput:
     download_limit:      IntRange | None = None
     download_count:      IntRange | None = None
 
+@strawberry.input
+class AddShareInput:
+    file_id: UUID
+    key: str
+    expiry: datetime | None = None
+    download_limit: int | None = None
+
+@strawberry.input
+class EditShareInput:
+    id: UUID | None = None
+    key: str | None = None
+    new_expiry: datetime | None = None
+    new_download_limit: int | None = None
+    new_key: str | None = None
+
+# Every sort ends with the primary key so that keyset pages are totally
+# ordered, and each has a matching composite index on `share`.
 @strawberry.enum
 class ShareSortField(Enum):
-    CREATED        = ["created", "updated"]
-    UPDATED        = ["updated", "created"]
-    EXPIRY         = ["expiry", "updated", "created"]
-    DOWNLOAD_COUNT = ["download_count", "updated", "created"]
-    DOWNLOAD_LIMIT = ["download_limit", "updated", "created"]
+    CREATED        = ["created", "updated", "id"]
+    UPDATED        = ["updated", "created", "id"]
+    EXPIRY         = ["expiry", "updated", "created", "id"]
+    DOWNLOAD_COUNT = ["download_count", "updated", "created", "id"]
+    DOWNLOAD_LIMIT = ["download_limit", "updated", "created", "id"]
 
 @strawberry.input
 class ShareSortInput:
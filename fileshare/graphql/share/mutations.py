@@ -1,4 +1,8 @@
-from sqlalchemy import select
+import uuid
+from sqlalchemy import Column, DateTime, Integer, String, cast, column, literal, or_, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
 import strawberry
 from strawberry.types import Info
 from asyncpg.exceptions import UniqueViolationError
@@ -6,11 +10,75 @@ from sqlalchemy.exc import IntegrityError
 from uuid import UUID
 from datetime import datetime
 
-from fileshare.database.engine import get_session
+from fileshare.settings import settings
 from fileshare.database.models import File, Share
 
+from fileshare.graphql.context import request_session
 from fileshare.graphql.file.types import FileNotFoundError, FileType
-from fileshare.graphql.share.types import EditShareError, ShareType, AddShareError, RemoveShareError, RemoveSharesResult
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.graphql.share.cache import share_cache
+from fileshare.graphql.share.inputs import AddShareInput, EditShareInput
+from fileshare.graphql.share.types import (
+    AddShareError,
+    AddSharesResult,
+    EditShareError,
+    EditSharesResult,
+    RemoveShareError,
+    RemoveSharesResult,
+    ShareType,
+)
+
+# Rows per multi-row INSERT; asyncpg accepts at most 32767 bind parameters per statement
+INSERT_BATCH_SIZE = 1000
+# Rows per `UPDATE ... FROM (VALUES ...)`, for the same reason
+EDIT_BATCH_SIZE = 1000
+
+
+async def apply_share_edits(session: AsyncSession, selector: Column, edits: list[EditShareInput]) -> list[Share]:
+    """Applies the edits of several shares, selected by `selector`, with `UPDATE ... FROM (VALUES ...)`.
+
+    Edits are applied `EDIT_BATCH_SIZE` at a time. Returns the edited shares.
+    Fields left as None are not changed.
+    """
+    # Every value is cast, since PostgreSQL would type a column of the VALUES
+    # list holding nothing but NULLs as text
+    columns = (("selector", selector.type), ("expiry", DateTime()), ("download_limit", Integer()), ("key", String()))
+    edited = []
+    for i in range(0, len(edits), EDIT_BATCH_SIZE):
+        # Fresh columns per batch, as a column belongs to the first VALUES it is given to
+        v = values(*(column(name, type_) for name, type_ in columns), name="v").data([
+            tuple(
+                cast(literal(value, type_), type_)
+                for value, (_, type_) in zip(
+                    (edit.id if selector is Share.id else edit.key, edit.new_expiry, edit.new_download_limit, edit.new_key),
+                    columns
+                )
+            )
+            for edit in edits[i:i + EDIT_BATCH_SIZE]
+        ])
+        result = await session.execute(
+            update(Share)
+            .where(selector == v.c.selector)
+            .values(
+                expiry=func.coalesce(v.c.expiry, Share.expiry),
+                download_limit=func.coalesce(v.c.download_limit, Share.download_limit),
+                key=func.coalesce(v.c.key, Share.key),
+            )
+            .returning(Share)
+            .execution_options(synchronize_session=False)
+        )
+        edited.extend(result.scalars().all())
+    return edited
+
+async def edit_shares_by_selector(session: AsyncSession, edits: list[EditShareInput]) -> dict[UUID | str, ShareType]:
+    """Applies share edits, returning the edited shares by the id or key each edit selected"""
+    edited: dict[UUID | str, ShareType] = {}
+    for share in await apply_share_edits(session, Share.id, [e for e in edits if e.id is not None]):
+        edited[share.id] = ShareType.from_instance(share)
+    by_key = {e.new_key or e.key: e.key for e in edits if e.id is None}
+    for share in await apply_share_edits(session, Share.key, [e for e in edits if e.id is None]):
+        edited[by_key.get(share.key, share.key)] = ShareType.from_instance(share)
+    return edited
 
 
 @strawberry.type
@@ -27,7 +95,7 @@ class ShareMutation:
         download_limit: int | None = None
     ) -> ShareType | AddShareError | FileNotFoundError:
 
-        async with get_session() as session:
+        async with request_session(info, write=True) as session:
             file_query = select(File).filter(File.id == file_id)
             result = await session.execute(file_query)
             file = result.scalar()
@@ -46,7 +114,71 @@ class ShareMutation:
                     return AddShareError(code="add_share_database_unique_violation_error", message=f"Could not add share: key already in use.")
                 else:
                     return AddShareError(code="add_share_unknown_error", message="Could not add share: unknown database integrity error.")
-            return share
+        await invalidate_responses("share", "file")
+        return share
+
+    @strawberry.mutation
+    async def add_shares(
+        self,
+        info: Info,
+        shares: list[AddShareInput]
+    ) -> AddSharesResult:
+
+        added = []
+        errors = []
+
+        if len(shares) > settings.graphql.bulk_limit:
+            errors.append(AddShareError(code="add_shares_malformed_request", message=f"At most {settings.graphql.bulk_limit} shares can be added at once."))
+            return AddSharesResult(added=added, errors=errors)
+
+        async with request_session(info, write=True) as session:
+            file_query = select(File.id).filter(File.id.in_({share.file_id for share in shares}))
+            file_ids = set((await session.execute(file_query)).scalars().all())
+
+            rows = []
+            keys = set()
+            for share in shares:
+                if share.file_id not in file_ids:
+                    errors.append(AddShareError(code="file_not_found", message=f"File with id={share.file_id} was not found in the database."))
+                elif share.key in keys:
+                    errors.append(AddShareError(code="add_share_database_unique_violation_error", message=f"Could not add share '{share.key}': key already in use."))
+                else:
+                    keys.add(share.key)
+                    rows.append({
+                        "id": uuid.uuid4(),
+                        "file_id": share.file_id,
+                        "key": share.key,
+                        "expiry": share.expiry,
+                        "download_limit": share.download_limit or 0,
+                    })
+
+            inserted = {}
+            try:
+                for i in range(0, len(rows), INSERT_BATCH_SIZE):
+                    insert_query = (
+                        insert(Share)
+                        .values(rows[i:i + INSERT_BATCH_SIZE])
+                        .on_conflict_do_nothing(index_elements=[Share.key])
+                        .returning(Share)
+                    )
+                    for db_share in (await session.execute(insert_query)).scalars().all():
+                        inserted[db_share.key] = ShareType.from_instance(db_share)
+                await session.commit()
+            except IntegrityError:
+                # e.g. a file was removed since it was checked
+                await session.rollback()
+                errors.extend(AddShareError(code="add_share_unknown_error", message=f"Could not add share '{row['key']}': unknown database integrity error.") for row in rows)
+                return AddSharesResult(added=added, errors=errors)
+
+        # Rows which were not inserted conflicted with an existing key
+        for row in rows:
+            if row["key"] in inserted:
+                added.append(inserted[row["key"]])
+            else:
+                errors.append(AddShareError(code="add_share_database_unique_violation_error", message=f"Could not add share '{row['key']}': key already in use."))
+        if added:
+            await invalidate_responses("share", "file")
+        return AddSharesResult(added=added, errors=errors)
 
     @strawberry.mutation
     async def remove_shares(
@@ -59,7 +191,7 @@ class ShareMutation:
         removed = []
         errors = []
 
-        async with get_session() as session:
+        async with request_session(info, write=True) as session:
 
             if ids is not None:
                 if keys is not None:
@@ -80,6 +212,9 @@ class ShareMutation:
                 removed.append(ShareType.from_instance(share))
 
             await session.commit()
+        await share_cache.invalidate(ids=[share.id for share in removed])
+        if removed:
+            await invalidate_responses("share", "file")
         return RemoveSharesResult(removed=removed, errors=errors)
 
     @strawberry.mutation
@@ -93,35 +228,133 @@ class ShareMutation:
         new_key: str | None = None
     ) -> ShareType | EditShareError:
 
-        async with get_session() as session:
-            if id is not None:
-                if key is not None:
-                    return EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id, not both.")
-                share_query = select(Share).filter(Share.id==id)
-            elif key is not None:
-                share_query = select(Share).filter(Share.key==key)
+        if id is not None:
+            if key is not None:
+                return EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id, not both.")
+            share_filter = Share.id==id
+        elif key is not None:
+            share_filter = Share.key==key
+        else:
+            return EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id.")
+
+        changes = {}
+        if new_expiry is not None:
+            changes["expiry"] = new_expiry
+        if new_download_limit is not None:
+            changes["download_limit"] = new_download_limit
+        if new_key is not None:
+            changes["key"] = new_key
+
+        if not changes and (cached := share_cache.get(id=id, key=key)) is not None:
+            return cached
+        generation = share_cache.generation
+
+        async with request_session(info, write=True) as session:
+            if changes:
+                share_query = (
+                    update(Share)
+                    .filter(share_filter)
+                    .values(**changes)
+                    .returning(Share)
+                    .execution_options(synchronize_session=False)
+                )
             else:
-                return EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id.")
-
-            result = await session.execute(share_query)
-            share = result.scalar()
-            if share is None:
-                if id is not None:
-                    return EditShareError(code="share_not_found", message=f"No share found with {id=}.")
-                if key is not None:
-                    return EditShareError(code="share_not_found", message=f"No share found with {key=}.")
-            if new_expiry is not None:
-                share.expiry = new_expiry
-            if new_download_limit is not None:
-                share.download_limit = new_download_limit
-            if new_key is not None:
-                share.key = new_key
-            out = ShareType.from_instance(share)
+                share_query = select(Share).filter(share_filter)
+
             try:
+                result = await session.execute(share_query)
+                share = result.scalar()
+                if share is None:
+                    if id is not None:
+                        return EditShareError(code="share_not_found", message=f"No share found with {id=}.")
+                    if key is not None:
+                        return EditShareError(code="share_not_found", message=f"No share found with {key=}.")
+                out = ShareType.from_instance(share)
                 await session.commit()
             except IntegrityError as e:
+                await session.rollback()
                 if isinstance(e.orig.__cause__, UniqueViolationError):
                     return EditShareError(code="edit_share_invalid_new_key", message=f"A share already exists with key '{new_key}'.")
                 else:
                     return EditShareError(code="edit_share_unknown_error", message=f"An unknown error has occurred.")
-            return out
+
+        if changes:
+            await share_cache.invalidate(ids=[out.id])
+            await invalidate_responses("share", "file")
+        else:
+            share_cache.set(out, generation)
+        return out
+
+    @strawberry.mutation
+    async def edit_shares(
+        self,
+        info: Info,
+        shares: list[EditShareInput]
+    ) -> EditSharesResult:
+
+        edited = []
+        errors = []
+
+        if len(shares) > settings.graphql.bulk_limit:
+            errors.append(EditShareError(code="edit_shares_malformed_request", message=f"At most {settings.graphql.bulk_limit} shares can be edited at once."))
+            return EditSharesResult(edited=edited, errors=errors)
+
+        edits = []
+        unchanged = []
+        selectors = set()
+        for share in shares:
+            selector = share.id if share.id is not None else share.key
+            if share.id is not None and share.key is not None:
+                errors.append(EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id, not both."))
+            elif selector is None:
+                errors.append(EditShareError(code="edit_share_malformed_request", message="Shares can only be selected for editing via key or id."))
+            elif selector in selectors:
+                errors.append(EditShareError(code="edit_share_malformed_request", message=f"Share '{selector}' can only be edited once per request."))
+            else:
+                selectors.add(selector)
+                if share.new_expiry is None and share.new_download_limit is None and share.new_key is None:
+                    unchanged.append(share)
+                else:
+                    edits.append(share)
+
+        async with request_session(info, write=True) as session:
+            try:
+                async with session.begin_nested():
+                    results = await edit_shares_by_selector(session, edits)
+            except IntegrityError:
+                # A new key is already in use; edit one share at a time to find out which
+                results = {}
+                for edit in edits:
+                    try:
+                        async with session.begin_nested():
+                            results.update(await edit_shares_by_selector(session, [edit]))
+                    except IntegrityError as e:
+                        if isinstance(e.orig.__cause__, UniqueViolationError):
+                            errors.append(EditShareError(code="edit_share_invalid_new_key", message=f"A share already exists with key '{edit.new_key}'."))
+                        else:
+                            errors.append(EditShareError(code="edit_share_unknown_error", message=f"An unknown error has occurred."))
+                        results[edit.id if edit.id is not None else edit.key] = None
+
+            if unchanged:
+                share_query = select(Share).filter(or_(
+                    Share.id.in_([share.id for share in unchanged if share.id is not None]),
+                    Share.key.in_([share.key for share in unchanged if share.id is None]),
+                ))
+                for db_share in (await session.execute(share_query)).scalars().all():
+                    results[db_share.id] = results[db_share.key] = ShareType.from_instance(db_share)
+            await session.commit()
+
+        changed = []
+        for share, is_edit in [(edit, True) for edit in edits] + [(share, False) for share in unchanged]:
+            selector = share.id if share.id is not None else share.key
+            if selector not in results:
+                errors.append(EditShareError(code="share_not_found", message=f"No share found with {'id' if share.id is not None else 'key'}={selector!r}."))
+            elif (out := results[selector]) is not None:
+                edited.append(out)
+                if is_edit:
+                    changed.append(out.id)
+
+        if changed:
+            await share_cache.invalidate(ids=changed)
+            await invalidate_responses("share", "file")
+        return EditSharesResult(edited=edited, errors=errors)
@@ -5,8 +5,9 @@ import strawberry
 from uuid import UUID
 from strawberry.types import Info
 
-from fileshare.database.engine import get_session
 from fileshare.database.models import Share
+from fileshare.graphql.context import request_session
+from fileshare.graphql.share.cache import share_cache
 from fileshare.graphql.share.inputs import ShareFilterInput, ShareSortField, ShareSortInput
 from fileshare.graphql.share.types import ShareType, ShareNotFoundError
 from fileshare.graphql.helpers import get_countable_connection
@@ -56,7 +57,10 @@ class ShareQuery:
     ) -> ShareType | ShareNotFoundError:
         if id is None and key is None:
             return ShareNotFoundError(code="share_not_found", message="Shares can only be looked up via ID or key.")
-        async with get_session() as session:
+        if (cached := share_cache.get(id=id, key=key)) is not None:
+            return cached
+        generation = share_cache.generation
+        async with request_session(info) as session:
             q = select(Share)
             if id is not None:
                 q = q.filter(Share.id == id)
@@ -65,7 +69,9 @@ class ShareQuery:
             result = await session.execute(q)
             share = result.scalar()
             if share:
-                return ShareType.from_instance(share)
+                out = ShareType.from_instance(share)
+                share_cache.set(out, generation, from_replica=info.context["session"].may_read_replica)
+                return out
             else:
                 return ShareNotFoundError(code="share_not_found", message=f"Could not find share with given ID and/or key.")
 
@@ -81,11 +87,11 @@ class ShareQuery:
         last: int | None = None
     ) -> CountableConnection[ShareType] | PaginationError:
 
-        async with get_session() as session:
+        async with request_session(info) as session:
 
             share_query = select(Share)
             if filter is not None:
                 share_query = apply_share_filters(share_query, filter)
             share_query = apply_share_sort(share_query, sort)
 
-            return await get_countable_connection(session, share_query, ShareType.from_instance, before, after, first, last)
+            return await get_countable_connection(session, share_query, ShareType.from_instance, before, after, first, last, info)
@@ -1,12 +1,10 @@
-from sqlalchemy import select
 import strawberry
 from datetime import datetime
 from uuid import UUID
 from typing import Annotated, TYPE_CHECKING
 
 from strawberry.types import Info
-from fileshare.database.engine import get_session
-from fileshare.database.models import File, Share
+from fileshare.database.models import Share
 
 from fileshare.graphql.types import ErrorType
 
@@ -15,14 +13,11 @@ if TYPE_CHECKING:
 
 async def resolve_file(root: "ShareType", info: Info) -> Annotated["FileType", strawberry.lazy("fileshare.graphql.file.types")]:
     from fileshare.graphql.file.types import FileType
-    async with get_session() as session:
-        query_files = select(File).filter(File.id==root.file_id)
-        result = await session.execute(query_files)
-        file = result.scalar()
-        if file:
-            return FileType.from_instance(file)
-        else:
-            return FileType(id=UUID(), created=datetime.now(), updated=datetime.now(), active=False, file_name="FILE NOT FOUND", share_count=0, download_count=0)
+    file = await info.context["loaders"].file.load(root.file_id)
+    if file:
+        return FileType.from_instance(file)
+    else:
+        return FileType(id=UUID(), created=datetime.now(), updated=datetime.now(), active=False, file_name="FILE NOT FOUND", share_count=0, download_count=0)
 
 @strawberry.type
 class ShareType:
@@ -57,6 +52,11 @@ class ShareNotFoundError(ErrorType):
 class AddShareError(ErrorType):
     pass
 
+@strawberry.type
+class AddSharesResult:
+    added: list[ShareType]
+    errors: list[AddShareError]
+
 @strawberry.type
 class RemoveShareError(ErrorType):
     pass
@@ -69,3 +69,8 @@ class RemoveSharesResult:
 @strawberry.type
 class EditShareError(ErrorType):
     pass
+
+@strawberry.type
+class EditSharesResult:
+    edited: list[ShareType]
+    errors: list[EditShareError]
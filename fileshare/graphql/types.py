@@ -1,10 +1,22 @@
+import asyncio
+import dataclasses
 from enum import Enum
-from typing import Generic, List, Optional, TypeVar
+from typing import Dict, Generic, List, NewType, Optional, Tuple, TypeVar
 
 import strawberry
+from graphql import GraphQLError
+
+from fileshare.settings import settings
 
 GenericType = TypeVar("GenericType")
 
+BigInt = strawberry.scalar(
+    NewType("BigInt", int),
+    serialize=int,
+    parse_value=int,
+    description="An integer which may not fit in 32 bits, e.g. a size in bytes",
+)
+
 
 @strawberry.enum
 class OrderDirection(Enum):
@@ -14,6 +26,29 @@ class OrderDirection(Enum):
     DESC = "desc"
 
 
+@strawberry.enum
+class CountStrategy(Enum):
+    """An enum for the ways of counting a whole result set"""
+
+    # COUNT(*) over the filtered result set
+    EXACT = "exact"
+    # COUNT(*) over at most `cap` rows; larger counts are reported as `cap`
+    CAPPED = "capped"
+    # The query planner's row estimate
+    ESTIMATE = "estimate"
+
+
+@strawberry.type
+class TotalCount:
+    """The size of a whole (filtered) result set"""
+
+    count: int
+    # Whether the result set has more than `count` entries (CAPPED only)
+    capped: bool
+    # Whether `count` is the query planner's estimate (ESTIMATE only)
+    estimated: bool
+
+
 @strawberry.type
 class Connection(Generic[GenericType]):
     """Represents a paginated relationship between two entities"""
@@ -22,11 +57,47 @@ class Connection(Generic[GenericType]):
     edges: List["Edge[GenericType]"]
 
 
+def count_key(strategy: "CountStrategy | str | None", cap: int | None) -> Tuple["CountStrategy", int | None]:
+    """Resolves the arguments of a `totalCount` selection, applying the defaults.
+
+    The cap only matters to CAPPED counts, so it is dropped from the key of
+    the others. Raises a GraphQLError if `cap` is negative.
+    """
+    if strategy is None:
+        strategy = settings.graphql.count_strategy
+    if isinstance(strategy, str):
+        strategy = CountStrategy[strategy.upper()]
+    if cap is None:
+        cap = settings.graphql.count_cap
+    if cap < 0:
+        raise GraphQLError("The cap of totalCount can not be negative.")
+    return strategy, cap if strategy == CountStrategy.CAPPED else None
+
+
 @strawberry.type
 class CountableConnection(Connection[GenericType]):
-    """Represents a paginated relationship between two entities"""
+    """Represents a paginated relationship between two entities
+
+    `count` is the number of entries on the current page. `totalCount` counts
+    the whole result set; it is only computed when selected, concurrently with
+    the page query. Each distinct (strategy, cap) among its selections is
+    counted once.
+    """
 
     count: int
+    total_count_tasks: strawberry.Private[Dict[Tuple[CountStrategy, Optional[int]], asyncio.Task]] = dataclasses.field(default_factory=dict)
+
+    @strawberry.field
+    async def total_count(
+        self,
+        strategy: Optional[CountStrategy] = None,
+        cap: Optional[int] = None
+    ) -> Optional[TotalCount]:
+        # The counts are started by `get_countable_connection`, keyed like this
+        task = self.total_count_tasks.get(count_key(strategy, cap))
+        if task is None:
+            return None
+        return await task
 
 
 @strawberry.type
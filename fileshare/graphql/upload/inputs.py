@@ -0,0 +1,6 @@
+import strawberry
+
+@strawberry.input
+class UploadPartInput:
+    part_number: int
+    etag: str
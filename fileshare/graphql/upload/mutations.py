@@ -0,0 +1,216 @@
+import math
+import secrets
+from datetime import datetime, timedelta
+from typing import Tuple
+from sqlalchemy import Select, delete, or_, select
+from sqlalchemy.sql import func
+import strawberry
+from strawberry.types import Info
+from asyncpg.exceptions import UniqueViolationError
+from sqlalchemy.exc import IntegrityError
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
+
+from fileshare.settings import settings
+from fileshare.database.models import File, Upload
+from fileshare.storage.minio import BucketDoesNotExist, FileDeleteError, storage
+
+from fileshare.graphql.context import request_session
+from fileshare.graphql.file.types import FileType
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.graphql.types import BigInt
+from fileshare.graphql.upload.inputs import UploadPartInput
+from fileshare.graphql.upload.types import UploadError, UploadPartType, UploadTargetType, UploadType
+
+# S3 allows at most this many parts in one multipart upload
+MAX_PARTS = 10000
+
+
+def part_size_for(size: int) -> int:
+    """Returns the part size for uploading `size` bytes: `MINIO__PART_SIZE`, or larger if needed to stay within `MAX_PARTS`"""
+    return max(settings.minio.part_size, math.ceil(size / MAX_PARTS))
+
+def live_upload_query(key: str) -> Select[Tuple[Upload]]:
+    """Selects the unexpired upload with `key`, locking it for the rest of the transaction"""
+    return (
+        select(Upload)
+        .filter(Upload.key == key, or_(Upload.expiry.is_(None), Upload.expiry > func.now()))
+        .with_for_update()
+    )
+
+
+@strawberry.type
+class UploadMutation:
+    """A Mutation class for uploading files directly to the storage backend"""
+
+    @strawberry.mutation
+    async def create_upload(
+        self,
+        info: Info,
+        key: str | None = None,
+        expiry: datetime | None = None
+    ) -> UploadType | UploadError:
+
+        if key is None:
+            key = secrets.token_urlsafe(24)
+        if expiry is None:
+            expiry = func.now() + timedelta(seconds=settings.minio.upload_key_expire)
+
+        async with request_session(info, write=True) as session:
+            try:
+                db_upload = Upload(key=key, expiry=expiry)
+                session.add(db_upload)
+                await session.flush()
+                await session.refresh(db_upload)
+                upload = UploadType.from_instance(db_upload)
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                if isinstance(e.orig.__cause__, UniqueViolationError):
+                    return UploadError(code="create_upload_key_in_use", message=f"Could not create upload: key already in use.")
+                else:
+                    return UploadError(code="create_upload_unknown_error", message="Could not create upload: unknown database integrity error.")
+        return upload
+
+    @strawberry.mutation
+    async def start_upload(
+        self,
+        info: Info,
+        key: str,
+        file_name: str,
+        size: BigInt
+    ) -> UploadTargetType | UploadError:
+
+        if size < 0:
+            return UploadError(code="start_upload_malformed_request", message="The size of an upload can not be negative.")
+
+        async with request_session(info, write=True) as session:
+            upload = (await session.execute(live_upload_query(key))).scalar()
+            if upload is None:
+                return UploadError(code="upload_not_found", message=f"Upload '{key}' was not found or has expired.")
+            # Restarting under the same name keeps the name's reservation
+            reserved = upload.file_id is not None and upload.object_name == file_name
+
+            try:
+                if upload.multipart_id is not None:
+                    # The upload is being restarted; discard the parts sent so far
+                    await storage.abort_multipart_upload(upload.object_name, upload.multipart_id)
+                if upload.file_id is not None and not reserved:
+                    # Removed while its name is still reserved, so that it can
+                    # not remove an object uploaded under the name later
+                    await storage.delete([upload.object_name])
+            except (S3Error, HTTPError, BucketDoesNotExist, FileDeleteError) as e:
+                print(e)
+                return UploadError(code="upload_storage_error", message=f"Could not start the upload of '{file_name}': storage backend failure.")
+
+            if not reserved:
+                try:
+                    if upload.file_id is not None:
+                        await session.execute(delete(File).filter(File.id == upload.file_id, File.active.is_(False)))
+                    # The bytes go straight to the file's name, which the
+                    # inactive row reserves from now on: no other upload or
+                    # file can take it, and downloads refuse the file until
+                    # the upload is completed
+                    db_file = File(object_name=file_name, active=False)
+                    session.add(db_file)
+                    await session.flush()
+                except IntegrityError as e:
+                    await session.rollback()
+                    if isinstance(e.orig.__cause__, UniqueViolationError):
+                        return UploadError(code="upload_file_exists", message=f"Could not upload '{file_name}': file already exists in database.")
+                    else:
+                        return UploadError(code="start_upload_unknown_error", message=f"Could not upload '{file_name}': unknown database integrity error.")
+                upload.file_id = db_file.id
+
+            multipart_id = None
+            try:
+                target = UploadTargetType(key=key, file_name=file_name, url=None, part_size=None, parts=[])
+                if size > settings.minio.multipart_threshold:
+                    target.part_size = part_size_for(size)
+                    multipart_id = await storage.create_multipart_upload(file_name)
+                    target.parts = [
+                        UploadPartType(part_number=n, url=await storage.presigned_upload_part(file_name, multipart_id, n))
+                        for n in range(1, math.ceil(size / target.part_size) + 1)
+                    ]
+                else:
+                    target.url = await storage.presigned_put(file_name)
+
+                upload.object_name = file_name
+                upload.size = size
+                upload.multipart_id = multipart_id
+                await session.commit()
+            except BaseException as e:
+                # Nothing refers to a multipart upload which was not recorded,
+                # so it is discarded here or never
+                if multipart_id is not None:
+                    try:
+                        await storage.abort_multipart_upload(file_name, multipart_id)
+                    except (S3Error, HTTPError, BucketDoesNotExist) as abort_error:
+                        print(abort_error)
+                if not isinstance(e, (S3Error, HTTPError, BucketDoesNotExist)):
+                    raise
+                print(e)
+                await session.rollback()
+                return UploadError(code="upload_storage_error", message=f"Could not start the upload of '{file_name}': storage backend failure.")
+        await invalidate_responses("file")
+        return target
+
+    @strawberry.mutation
+    async def complete_upload(
+        self,
+        info: Info,
+        key: str,
+        parts: list[UploadPartInput] | None = None
+    ) -> FileType | UploadError:
+
+        async with request_session(info, write=True) as session:
+            upload = (await session.execute(live_upload_query(key))).scalar()
+            if upload is None:
+                return UploadError(code="upload_not_found", message=f"Upload '{key}' was not found or has expired.")
+            if upload.file_id is None:
+                return UploadError(code="upload_not_started", message=f"Upload '{key}' has not been started.")
+            name = upload.object_name
+
+            try:
+                if upload.multipart_id is not None:
+                    if not parts:
+                        return UploadError(code="complete_upload_malformed_request", message=f"The parts of '{name}' must be given to complete its upload.")
+                    try:
+                        await storage.complete_multipart_upload(name, upload.multipart_id, [(p.part_number, p.etag) for p in parts])
+                    except S3Error as e:
+                        # The upload may have been completed by an earlier attempt
+                        if e.code != "NoSuchUpload":
+                            raise
+                stat = await storage.stat(name)
+            except (S3Error, HTTPError, BucketDoesNotExist) as e:
+                print(e)
+                return UploadError(code="upload_storage_error", message=f"Could not complete the upload of '{name}': storage backend failure.")
+
+            if stat is None:
+                return UploadError(code="upload_object_not_found", message=f"'{name}' has not been uploaded.")
+            db_file = await session.get(File, upload.file_id, with_for_update=True)
+            if stat.size != upload.size:
+                error = UploadError(code="upload_size_mismatch", message=f"'{name}' is {stat.size} bytes, but {upload.size} bytes were declared.")
+                # Discard the object, and release its name once it is gone,
+                # so that the upload can be started again
+                try:
+                    await storage.delete([name])
+                except (S3Error, HTTPError, FileDeleteError) as e:
+                    print(e)
+                    await session.rollback()
+                    return error
+                await session.delete(db_file)
+                upload.object_name = upload.size = upload.multipart_id = upload.file_id = None
+                await session.commit()
+                await invalidate_responses("file")
+                return error
+
+            db_file.active = True
+            await session.delete(upload)
+            await session.flush()
+            await session.refresh(db_file)
+            out = FileType.from_instance(db_file)
+            await session.commit()
+
+        await invalidate_responses("file")
+        return out
@@ -0,0 +1,49 @@
+import strawberry
+from datetime import datetime
+from uuid import UUID
+
+from fileshare.database.models import Upload
+from fileshare.graphql.types import BigInt, ErrorType
+
+
+@strawberry.type
+class UploadType:
+    id: UUID
+    created: datetime
+    updated: datetime
+    key: str
+    expiry: datetime | None
+    file_name: str | None
+    size: BigInt | None
+
+    @classmethod
+    def from_instance(cls, instance: Upload):
+        return cls(
+            id=instance.id,
+            created=instance.created,
+            updated=instance.updated,
+            key=instance.key,
+            expiry=instance.expiry,
+            file_name=instance.object_name,
+            size=instance.size
+        )
+
+@strawberry.type
+class UploadPartType:
+    part_number: int
+    url: str
+
+@strawberry.type
+class UploadTargetType:
+    """Where to upload a file: either a single `url` to PUT the whole file to,
+    or the `parts` of a multipart upload, each `partSize` bytes except the last"""
+
+    key: str
+    file_name: str
+    url: str | None
+    part_size: BigInt | None
+    parts: list[UploadPartType]
+
+@strawberry.type
+class UploadError(ErrorType):
+    pass
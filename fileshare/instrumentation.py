@@ -0,0 +1,22 @@
+from typing import Any
+
+from fastapi import APIRouter
+
+from fileshare.database.engine import pool_stats, replicas
+from fileshare.graphql.persisted import cache_stats
+from fileshare.reaper import reaper
+
+
+router = APIRouter()
+
+@router.get("/stats")
+async def stats() -> dict[str, Any]:
+    """Reports live runtime statistics of the application"""
+    return {
+        "database": {
+            "pool": pool_stats(),
+            "replicas": replicas.stats(),
+        },
+        "graphql": cache_stats(),
+        "reaper": reaper.stats(),
+    }
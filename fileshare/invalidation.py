@@ -0,0 +1,137 @@
+import json
+import asyncio
+from typing import Any, Callable
+
+from sqlalchemy import select
+from sqlalchemy.sql import func
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from fileshare.settings import settings
+from fileshare.database.engine import engine
+
+Message = dict[str, Any]
+
+# pg_notify payloads must be shorter than 8000 bytes
+MAX_PAYLOAD = 7900
+
+
+class InvalidationBus:
+
+    """Delivers cache invalidation messages to every subscribed cache.
+
+    Messages are JSON-serializable dicts published on a named channel. A
+    message with `"all": True` asks subscribers to drop everything they cache.
+    Publishing always delivers the message to the local subscribers before
+    returning, so it should be called once the change has been committed.
+
+    Methods:
+        subscribe(channel, callback) -- Calls `callback(message)` for every
+            message published on `channel`.
+
+        publish(channel, message) -- Publishes a message on `channel`.
+
+        start() -- Starts receiving messages from other workers.
+
+        close() -- Stops receiving messages from other workers.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: dict[str, list[Callable[[Message], None]]] = {}
+
+    def subscribe(self, channel: str, callback: Callable[[Message], None]) -> None:
+        """Registers a callback for the messages published on a channel"""
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _deliver(self, channel: str, message: Message) -> None:
+        for callback in self._subscribers.get(channel, []):
+            callback(message)
+
+    async def publish(self, channel: str, message: Message) -> None:
+        """Publishes a message to the subscribers of a channel"""
+        self._deliver(channel, message)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryInvalidationBus(InvalidationBus):
+
+    """An invalidation bus for a single process; messages never leave the worker."""
+
+
+class PostgresInvalidationBus(InvalidationBus):
+
+    """An invalidation bus which relays messages between workers with LISTEN/NOTIFY.
+
+    One connection per worker is held open to LISTEN on the subscribed
+    channels. Notifications sent by this worker are also received back and
+    delivered a second time, which is harmless for invalidations. Messages
+    too large for a notification are sent as `{"all": True}`. If the listening
+    connection is lost, subscribers are told to drop everything and the
+    connection is re-established.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._conn: AsyncConnection | None = None
+        self._reconnect: asyncio.Task | None = None
+
+    def _on_notify(self, connection, pid, channel: str, payload: str) -> None:
+        self._deliver(channel, json.loads(payload))
+
+    def _on_terminate(self, connection) -> None:
+        self._conn = None
+        for channel in self._subscribers:
+            self._deliver(channel, {"all": True})
+        self._reconnect = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        while self._conn is None:
+            try:
+                conn = await engine.connect()
+                raw = (await conn.get_raw_connection()).driver_connection
+                for channel in self._subscribers:
+                    await raw.add_listener(channel, self._on_notify)
+                raw.add_termination_listener(self._on_terminate)
+                self._conn = conn
+            except Exception as e:
+                print(e)
+                await asyncio.sleep(1)
+
+    async def publish(self, channel: str, message: Message) -> None:
+        """Publishes a message locally and then to the other workers"""
+        self._deliver(channel, message)
+        payload = json.dumps(message, default=str)
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD:
+            payload = json.dumps({"all": True})
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(select(func.pg_notify(channel, payload)))
+
+    async def start(self) -> None:
+        """Starts listening for messages from other workers"""
+        await self._listen()
+
+    async def close(self) -> None:
+        """Stops listening for messages from other workers"""
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            raw = (await conn.get_raw_connection()).driver_connection
+            raw.remove_termination_listener(self._on_terminate)
+            await conn.close()
+
+
+def get_invalidation_bus(name: str) -> InvalidationBus:
+    """Creates the invalidation bus named in the settings"""
+    if name == "postgres":
+        return PostgresInvalidationBus()
+    return MemoryInvalidationBus()
+
+
+invalidation_bus = get_invalidation_bus(settings.cache.invalidation_bus)
@@ -1,7 +1,36 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from fileshare.database.engine import replicas
+from fileshare.download import download_counter, router as download_router
 from fileshare.graphql.schema import graphql_app
+from fileshare.instrumentation import router as instrumentation_router
+from fileshare.invalidation import invalidation_bus
+from fileshare.reaper import reaper
+from fileshare.settings import settings
+from fileshare.storage.minio import storage
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await storage.start()
+    await replicas.start()
+    await invalidation_bus.start()
+    if download_counter is not None:
+        await download_counter.start()
+    if settings.reaper.enabled:
+        await reaper.start()
+    yield
+    await reaper.close()
+    if download_counter is not None:
+        await download_counter.close()
+    await invalidation_bus.close()
+    await replicas.close()
+    await storage.close()
 
 
-app = FastAPI(dependencies=[])
+app = FastAPI(dependencies=[], lifespan=lifespan)
 app.include_router(graphql_app, prefix="/gql")
+app.include_router(download_router)
+app.include_router(instrumentation_router)
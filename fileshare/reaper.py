@@ -0,0 +1,247 @@
+#!/bin/env python
+"""Deletes expired and exhausted shares and expired upload keys, releases
+stale download reservations, and rolls share downloads up into their files'
+download counts.
+
+Runs in the background of the application when `REAPER__ENABLED` is set, or
+once from the command line with:
+
+    python -m fileshare.reaper
+"""
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator
+
+from sqlalchemy import Column, ColumnElement, Row, delete, select, tuple_
+from sqlalchemy.sql import func
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
+
+from fileshare.settings import settings
+from fileshare.settings.reaper import ReaperSettings
+from fileshare.database.counts import roll_up_download_counts
+from fileshare.database.engine import engine
+from fileshare.database.models import File, Share, Upload
+from fileshare.download import release_stale_reservations
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.graphql.share.cache import share_cache
+from fileshare.storage.minio import BucketDoesNotExist, FileDeleteError, storage
+
+
+class ReapStats:
+
+    """Metrics of one reaper run.
+
+    Attributes:
+        started -- When the run started.
+        duration -- How long the run took, in seconds.
+        batches -- The number of batches deleted.
+        expired_shares -- The number of shares deleted because they expired.
+        exhausted_shares -- The number of shares deleted because they reached
+            their download limit.
+        expired_uploads -- The number of upload keys deleted because they expired.
+        released_reservations -- The number of stale download reservations
+            released.
+        rolled_up_shares -- The number of shares whose downloads were added to
+            their file's download count.
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.now(timezone.utc)
+        self.duration = 0.0
+        self.batches = 0
+        self.expired_shares = 0
+        self.exhausted_shares = 0
+        self.expired_uploads = 0
+        self.released_reservations = 0
+        self.rolled_up_shares = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "started": self.started.isoformat(),
+            "duration": self.duration,
+            "batches": self.batches,
+            "expired_shares": self.expired_shares,
+            "exhausted_shares": self.exhausted_shares,
+            "expired_uploads": self.expired_uploads,
+            "released_reservations": self.released_reservations,
+            "rolled_up_shares": self.rolled_up_shares,
+        }
+
+
+class Reaper:
+
+    """Periodically deletes rows which can no longer be used.
+
+    These are shares past their expiry, shares which have reached their
+    download limit, and upload keys past their expiry. Each kind is found
+    through a partial index and deleted in batches of `REAPER__BATCH_SIZE`
+    rows, each batch in its own short transaction, walking the index in
+    keyset order and pausing `REAPER__BATCH_PAUSE` seconds between batches.
+    Rows locked by other transactions are skipped until the next run, so
+    several reapers never wait on each other or on downloads.
+
+    Expired upload keys which were started also take their storage with
+    them: their multipart uploads are aborted and their objects deleted,
+    after which the inactive files reserving their names are removed.
+
+    Each run also releases the download reservations of write-behind
+    counters which have not renewed them for `DOWNLOAD__RESERVATION_LEASE`
+    seconds, and adds the downloads counted on `share` rows since the last
+    run to their files' `download_count`, in batches of the same size.
+
+    Methods:
+        run() -- Reaps everything once, returning the run's metrics.
+
+        stats() -- Returns the metrics of the last run and the totals.
+
+        start() -- Starts reaping every `REAPER__INTERVAL` seconds.
+
+        close() -- Stops reaping.
+    """
+
+    def __init__(self, conf: ReaperSettings) -> None:
+        self._conf = conf
+        self._task: asyncio.Task | None = None
+
+        self.last_run: ReapStats | None = None
+        self.runs = 0
+        self.deleted = 0
+
+    async def _reap(self, table: Any, where: list[ColumnElement[bool]], keyset: list[Column], returning: list[Column]) -> AsyncGenerator[list[Row], None]:
+        """Deletes the rows matching `where` in batches ordered by `keyset`, yielding each batch"""
+        last = None
+        while True:
+            candidates = (
+                select(table.id)
+                .where(*where)
+                .order_by(*keyset)
+                .limit(self._conf.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            if last is not None:
+                candidates = candidates.where(tuple_(*keyset) > tuple_(*last))
+            async with engine.begin() as conn:
+                rows = (await conn.execute(
+                    delete(table).where(table.id.in_(candidates)).returning(*keyset, *returning)
+                )).all()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self._conf.batch_size:
+                return
+            last = max(tuple(row[:len(keyset)]) for row in rows)
+            await asyncio.sleep(self._conf.batch_pause)
+
+    async def _reap_shares(self, stats: ReapStats, attribute: str, where: list[ColumnElement[bool]], keyset: list[Column]) -> None:
+        async for rows in self._reap(Share, where, keyset, [Share.id]):
+            stats.batches += 1
+            setattr(stats, attribute, getattr(stats, attribute) + len(rows))
+            await share_cache.invalidate(ids=[row[-1] for row in rows])
+            await invalidate_responses("share", "file")
+
+    async def _reap_uploads(self, stats: ReapStats) -> None:
+        where = [Upload.expiry.isnot(None), Upload.expiry < func.now()]
+        returning = [Upload.object_name, Upload.multipart_id, Upload.file_id]
+        async for rows in self._reap(Upload, where, [Upload.expiry, Upload.id], returning):
+            stats.batches += 1
+            stats.expired_uploads += len(rows)
+            reserved = [row for row in rows if row.file_id is not None]
+            try:
+                for row in rows:
+                    if row.multipart_id is not None:
+                        await storage.abort_multipart_upload(row.object_name, row.multipart_id)
+                await storage.delete([row.object_name for row in reserved])
+            except (S3Error, HTTPError, BucketDoesNotExist, FileDeleteError) as e:
+                # The names stay reserved by inactive files, rather than
+                # letting a later upload's object be mistaken for these
+                print(e)
+                continue
+            if not reserved:
+                continue
+            # Released only once their objects are gone
+            async with engine.begin() as conn:
+                await conn.execute(delete(File).where(File.id.in_([row.file_id for row in reserved]), File.active.is_(False)))
+            await invalidate_responses("file")
+
+    async def _release_reservations(self, stats: ReapStats) -> None:
+        while True:
+            async with engine.begin() as conn:
+                n_rows = await release_stale_reservations(conn, settings.download.reservation_lease, self._conf.batch_size)
+            if not n_rows:
+                return
+            stats.batches += 1
+            stats.released_reservations += n_rows
+            await invalidate_responses("share")
+            if n_rows < self._conf.batch_size:
+                return
+            await asyncio.sleep(self._conf.batch_pause)
+
+    async def _roll_up_downloads(self, stats: ReapStats) -> None:
+        while True:
+            async with engine.begin() as conn:
+                n_rows = await roll_up_download_counts(conn, self._conf.batch_size)
+            if not n_rows:
+                return
+            stats.batches += 1
+            stats.rolled_up_shares += n_rows
+            await invalidate_responses("file")
+            if n_rows < self._conf.batch_size:
+                return
+            await asyncio.sleep(self._conf.batch_pause)
+
+    async def run(self) -> ReapStats:
+        stats = ReapStats()
+        start = time.perf_counter()
+
+        await self._reap_shares(stats, "expired_shares", [Share.expiry.isnot(None), Share.expiry < func.now()], [Share.expiry, Share.id])
+        await self._reap_shares(stats, "exhausted_shares", [Share.download_limit > 0, Share.download_count >= Share.download_limit], [Share.id])
+        await self._reap_uploads(stats)
+        await self._release_reservations(stats)
+        await self._roll_up_downloads(stats)
+
+        stats.duration = time.perf_counter() - start
+        self.last_run = stats
+        self.runs += 1
+        self.deleted += stats.expired_shares + stats.exhausted_shares + stats.expired_uploads
+        return stats
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_run": self.last_run.as_dict() if self.last_run is not None else None,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                print(e)
+            await asyncio.sleep(self._conf.interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+reaper = Reaper(settings.reaper)
+
+async def main():
+    stats = await reaper.run()
+    print(
+        f"Deleted {stats.expired_shares} expired share(s), {stats.exhausted_shares} exhausted share(s) "
+        f"and {stats.expired_uploads} expired upload key(s), released {stats.released_reservations} stale reservation(s) "
+        f"and rolled up the downloads of {stats.rolled_up_shares} share(s), "
+        f"in {stats.batches} batch(es) ({stats.duration:.2f}s)."
+    )
+    await engine.dispose()
+
+if __name__=="__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+#!/bin/env python
+"""Finds (and optionally fixes) drift between the bucket and the `file` table.
+
+Objects in the bucket without a `file` row are orphaned, e.g. when a commit
+failed after the upload, and rows without an object are dangling, e.g. when a
+commit failed after the object was deleted. Run with:
+
+    python -m fileshare.reconcile [--fix] [--prefix PREFIX]
+
+Without `--fix` the drift is only reported. With it, orphaned objects are
+deleted from the bucket and dangling rows (with their shares) from the
+database.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import AsyncGenerator, AsyncIterator
+from uuid import UUID
+
+from sqlalchemy import delete, select
+from sqlalchemy.sql import func
+
+from fileshare.database.engine import engine
+from fileshare.database.models import File, Upload
+from fileshare.graphql.response_cache import invalidate_responses
+from fileshare.graphql.share.cache import share_cache
+from fileshare.storage.minio import FileDeleteError, storage
+
+# The bucket lists objects in byte-wise order of their (UTF-8) names, which
+# is the order of Python strings and of the "C" collation
+NAME_ORDER = File.object_name.collate("C")
+
+
+class Reconciler:
+
+    """Merge-joins the bucket listing with the `file` table by object name.
+
+    Both sides are streamed in name order a page at a time (the bucket with
+    paginated listing, the table with a keyset scan over
+    `idx_file_object_name_c`), so memory use does not grow with the number of
+    objects. Drift is handled in batches of `batch_size` names. Objects and
+    rows younger than `grace` are never counted as drift, since they may
+    belong to an upload which is still in progress.
+
+    Attributes:
+        objects -- The number of objects scanned.
+        rows -- The number of rows scanned.
+        orphaned -- The number of orphaned objects found.
+        dangling -- The number of dangling rows found.
+        fixed -- The number of orphaned objects and dangling rows removed.
+    """
+
+    def __init__(self, prefix: str, batch_size: int, grace: timedelta, fix: bool) -> None:
+        self._prefix = prefix
+        self._batch_size = batch_size
+        self._grace = grace
+        self._fix = fix
+
+        self.objects = 0
+        self.rows = 0
+        self.orphaned = 0
+        self.dangling = 0
+        self.fixed = 0
+
+    async def _objects(self) -> AsyncGenerator[tuple[str, bool], None]:
+        """Yields the name of every object, and whether it is older than the grace period"""
+        settled_before = datetime.now(timezone.utc) - self._grace
+        async for page in storage.scan(self._prefix, self._batch_size):
+            for obj in page:
+                self.objects += 1
+                yield obj.object_name, obj.last_modified is None or obj.last_modified < settled_before
+
+    async def _rows(self) -> AsyncGenerator[tuple[str, UUID, bool], None]:
+        """Yields the name and ID of every row, and whether it is older than the grace period"""
+        last = None
+        while True:
+            rows_query = (
+                select(File.object_name, File.id, File.created < func.now() - self._grace)
+                .filter(NAME_ORDER > last if last is not None else NAME_ORDER >= self._prefix)
+                .order_by(NAME_ORDER)
+                .limit(self._batch_size)
+            )
+            async with engine.connect() as conn:
+                page = (await conn.execute(rows_query)).all()
+            for name, id, settled in page:
+                # Names below the prefix are contiguous, so the first one
+                # outside it ends the scan
+                if not name.startswith(self._prefix):
+                    return
+                self.rows += 1
+                yield name, id, settled
+            if len(page) < self._batch_size:
+                return
+            last = page[-1][0]
+
+    async def _remove_objects(self, names: list[str]) -> None:
+        self.orphaned += len(names)
+        for name in names:
+            print(f"Orphaned object: {name}")
+        if not self._fix:
+            return
+        try:
+            await storage.delete(names)
+        except FileDeleteError as e:
+            print(e.message)
+            self.fixed -= len(e.filenames)
+        self.fixed += len(names)
+
+    async def _remove_rows(self, rows: list[tuple[str, UUID]]) -> None:
+        self.dangling += len(rows)
+        for name, _ in rows:
+            print(f"Dangling row: {name}")
+        if not self._fix:
+            return
+        file_ids = [id for _, id in rows]
+        async with engine.begin() as conn:
+            # The rows reserving the names of direct uploads which have not
+            # been completed yet have no object until the bytes are uploaded
+            reserved = select(Upload.file_id).filter(Upload.file_id.in_(file_ids))
+            result = await conn.execute(delete(File).filter(File.id.in_(file_ids), File.id.not_in(reserved)))
+        self.fixed += result.rowcount
+        await share_cache.invalidate(file_ids=file_ids)
+        await invalidate_responses("file", "share")
+
+    async def run(self) -> None:
+        orphaned: list[str] = []
+        dangling: list[tuple[str, UUID]] = []
+
+        objects: AsyncIterator[tuple[str, bool]] = self._objects()
+        rows: AsyncIterator[tuple[str, UUID, bool]] = self._rows()
+        obj = await anext(objects, None)
+        row = await anext(rows, None)
+        while obj is not None or row is not None:
+            if row is None or (obj is not None and obj[0] < row[0]):
+                name, settled = obj
+                if settled:
+                    orphaned.append(name)
+                obj = await anext(objects, None)
+            elif obj is None or row[0] < obj[0]:
+                name, id, settled = row
+                if settled:
+                    dangling.append((name, id))
+                row = await anext(rows, None)
+            else:
+                obj = await anext(objects, None)
+                row = await anext(rows, None)
+
+            if len(orphaned) >= self._batch_size:
+                await self._remove_objects(orphaned)
+                orphaned = []
+            if len(dangling) >= self._batch_size:
+                await self._remove_rows(dangling)
+                dangling = []
+
+        if orphaned:
+            await self._remove_objects(orphaned)
+        if dangling:
+            await self._remove_rows(dangling)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Finds drift between the bucket and the file table.")
+    parser.add_argument("--fix", action="store_true", help="delete orphaned objects and dangling rows")
+    parser.add_argument("--prefix", default="", help="only reconcile objects below this prefix")
+    parser.add_argument("--batch-size", type=int, default=1000, help="names fetched and fixed per batch")
+    parser.add_argument("--grace", type=int, default=3600, help="ignore objects and rows younger than this many seconds")
+    args = parser.parse_args()
+
+    reconciler = Reconciler(args.prefix, args.batch_size, timedelta(seconds=args.grace), args.fix)
+    await reconciler.run()
+    print(
+        f"Scanned {reconciler.objects} object(s) and {reconciler.rows} row(s): "
+        f"{reconciler.orphaned} orphaned object(s), {reconciler.dangling} dangling row(s), {reconciler.fixed} fixed."
+    )
+    await storage.close()
+    await engine.dispose()
+
+if __name__=="__main__":
+    asyncio.run(main())
@@ -1,8 +1,11 @@
 from pydantic_settings import BaseSettings
 
+from fileshare.settings.cache import CacheSettings
 from fileshare.settings.database import DatabaseSettings
+from fileshare.settings.download import DownloadSettings
 from fileshare.settings.minio import MinioSettings
 from fileshare.settings.graphql import GraphQLSettings
+from fileshare.settings.reaper import ReaperSettings
 
 class Settings(BaseSettings):
 
@@ -11,6 +14,9 @@ class Settings(BaseSettings):
     minio: MinioSettings
     database: DatabaseSettings
     graphql: GraphQLSettings
+    download: DownloadSettings = DownloadSettings()
+    cache: CacheSettings = CacheSettings()
+    reaper: ReaperSettings = ReaperSettings()
 
     class Config:
         env_prefix = ""
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+
+class CacheSettings(BaseModel):
+
+    """A class for storing the in-process cache configuration"""
+
+    # Maximum number of shares cached for lookups by key or ID
+    share_cache_size: int = 10000
+    # Seconds a cached share is served for. Download counts of cached shares
+    # may lag by up to this long, other changes are invalidated immediately.
+    share_cache_ttl: float = 30
+    # How cache invalidations reach other workers: "memory" (single worker)
+    # or "postgres" (LISTEN/NOTIFY)
+    invalidation_bus: str = "memory"
+    # Cache the responses of query operations. Every counted download
+    # invalidates the cached share responses, so busy download endpoints are
+    # best combined with `DOWNLOAD__WRITE_BEHIND`, which invalidates once per flush
+    response_cache: bool = False
+    # Maximum number of responses cached
+    response_cache_size: int = 1000
+    # Seconds responses are cached for, by top-level query field. Operations
+    # selecting any other top-level field are not cached.
+    response_cache_ttls: dict[str, float] = {"file": 10, "files": 10, "browse": 10, "share": 10, "shares": 10}
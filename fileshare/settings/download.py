@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+class DownloadSettings(BaseModel):
+
+    """A class for storing the share download configuration"""
+
+    # Accumulate download counts in memory and write them in batches
+    write_behind: bool = False
+    # Seconds between write-behind flushes
+    flush_interval: float = 1.0
+    # Number of pending downloads which triggers an early flush
+    flush_threshold: int = 1000
+    # Number of downloads reserved at once for shares with a download limit
+    reservation_size: int = 10
+    # Seconds after which the reaper releases the reservations of a worker
+    # which stopped renewing them (one that was killed, say); workers renew
+    # theirs four times per lease, on a flush
+    reservation_lease: float = 60
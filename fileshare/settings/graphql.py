@@ -6,3 +6,25 @@ class GraphQLSettings(BaseModel):
 
     default_page_size: int
     pagination_limit: int
+    # Number of files processed concurrently by the `add_files` mutation
+    upload_concurrency: int = 4
+    # Default strategy for `totalCount`: "exact", "capped" or "estimate"
+    count_strategy: str = "capped"
+    # Default cap for the "capped" `totalCount` strategy
+    count_cap: int = 1000
+    # Key for signing pagination cursors; defaults to one derived from the minio secret key
+    cursor_secret: str | None = None
+    # Operations costing more than this are rejected before execution
+    max_query_cost: int = 5000
+    # Operations nesting fields deeper than this are rejected before execution
+    max_query_depth: int = 10
+    # Maximum number of items accepted by the bulk `addShares` and `editShares` mutations
+    bulk_limit: int = 10000
+    # Assumed length of lists which are not paginated, e.g. `FileType.shares`
+    cost_list_size: int = 10
+    # Cost of individual fields by "Type.field", e.g. {"FileType.shares": 5}
+    field_costs: dict[str, int] = {}
+    # Maximum number of persisted queries remembered by hash
+    persisted_query_cache_size: int = 10000
+    # Maximum number of parsed and validated documents cached
+    document_cache_size: int = 1000
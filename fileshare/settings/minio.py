@@ -10,3 +10,33 @@ class MinioSettings(BaseModel):
     secret_key: str
     upload_expire: int
     download_expire: int
+    # Seconds until an upload key created without an expiry expires
+    upload_key_expire: int = 7 * 24 * 60 * 60
+    # Bucket region; when unset it is looked up once during the bucket check
+    region: str | None = None
+    # Number of threads running blocking minio client calls
+    executor_workers: int = 8
+    # Maximum number of storage calls in flight (running or queued) at once
+    max_concurrency: int = 16
+    # Size of the shared urllib3 connection pool
+    pool_maxsize: int = 16
+    # urllib3 timeouts (in seconds)
+    connect_timeout: float = 5.0
+    read_timeout: float = 300.0
+    # Number of retries urllib3 makes on connection errors and 5xx responses
+    retries: int = 3
+    # Objects larger than this (in bytes, at least 5MiB) are uploaded as
+    # multipart uploads streamed in parts of this size
+    part_size: int = 16 * 1024 * 1024
+    # Number of parts of a single multipart upload sent concurrently
+    parallel_parts: int = 2
+    # Direct uploads larger than this (in bytes) are made as multipart uploads
+    # of `part_size` parts, each with its own presigned url
+    multipart_threshold: int = 64 * 1024 * 1024
+    # Maximum number of presigned download urls cached
+    presign_cache_size: int = 10000
+    # Cached download urls are only handed out while they remain valid for at
+    # least this many seconds
+    presign_cache_margin: int = 15
+    # Seconds between background checks that the bucket still exists
+    bucket_check_interval: int = 300
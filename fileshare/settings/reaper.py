@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+class ReaperSettings(BaseModel):
+
+    """A class for storing the configuration of the expired row reaper"""
+
+    # Run the reaper in the background of the application
+    enabled: bool = False
+    # Seconds between runs
+    interval: float = 300
+    # Number of rows deleted per batch (and transaction)
+    batch_size: int = 500
+    # Seconds to pause between batches
+    batch_pause: float = 0.1
@@ -0,0 +1,100 @@
+import os
+import asyncio
+from concurrent.futures import Executor
+
+import certifi
+import urllib3
+from minio import Minio
+
+from fileshare.settings.minio import MinioSettings
+
+
+class MinioConnection:
+
+    """Manages the minio client and the cached existence of its bucket.
+
+    The bucket is checked once (normally at startup via `start`) and the result
+    is cached, so ordinary storage calls and presigning do not make an extra
+    `bucket_exists` request. A background task re-checks the bucket every
+    `MINIO__BUCKET_CHECK_INTERVAL` seconds, or straight away after `invalidate`
+    is called following a storage error.
+
+    Attributes:
+        client -- The shared minio client, backed by one urllib3 pool.
+        bucket_exists -- The cached result of the last bucket check, or None if
+            the bucket has not been checked yet.
+    """
+
+    def __init__(self, conf: MinioSettings) -> None:
+        self._conf = conf
+        self._client: Minio | None = None
+        self._stale = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        self.bucket_exists: bool | None = None
+
+    @property
+    def client(self) -> Minio:
+        """Retrieves the (or creates a) minio client, without any network calls"""
+        if not self._client:
+            http_client = urllib3.PoolManager(
+                maxsize=self._conf.pool_maxsize,
+                timeout=urllib3.Timeout(connect=self._conf.connect_timeout, read=self._conf.read_timeout),
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=urllib3.Retry(
+                    total=self._conf.retries,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504]
+                )
+            )
+            self._client = Minio(
+                endpoint=self._conf.endpoint,
+                access_key=self._conf.access_key,
+                secret_key=self._conf.secret_key,
+                region=self._conf.region,
+                http_client=http_client
+            )
+        return self._client
+
+    def check(self) -> bool:
+        """Checks (blocking) that the bucket exists and caches the result.
+
+        This also caches the bucket region in the client, after which
+        presigning URLs requires no network access.
+        """
+        self.bucket_exists = self.client.bucket_exists(self._conf.bucket)
+        return self.bucket_exists
+
+    def invalidate(self) -> None:
+        """Requests a background re-check of the bucket"""
+        self._stale.set()
+
+    async def start(self, executor: Executor) -> None:
+        """Checks the bucket and starts the background revalidation task"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.check)
+        self._task = asyncio.create_task(self._revalidate(executor))
+
+    async def stop(self) -> None:
+        """Stops the background revalidation task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _revalidate(self, executor: Executor) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._stale.wait(), timeout=self._conf.bucket_check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._stale.clear()
+            try:
+                await loop.run_in_executor(executor, self.check)
+            except Exception as e:
+                print(e)
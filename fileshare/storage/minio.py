@@ -1,9 +1,20 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncGenerator, Callable, Iterator, List
+
 from minio import Minio
+from minio.datatypes import Object, Part
 from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
 from datetime import timedelta
 
+from fileshare.cache import TTLCache
 from fileshare.settings import settings
 from fileshare.settings.minio import MinioSettings
+from fileshare.storage.connection import MinioConnection
 
 
 class BucketDoesNotExist(Exception):
@@ -52,96 +63,273 @@ class MinioStorage:
 
     """A storage interface using Minio.
 
+    The minio client is synchronous, so every call which may touch the network
+    is run on a dedicated thread pool (`MINIO__EXECUTOR_WORKERS` threads) and
+    awaited, keeping the event loop free. A semaphore bounds the number of
+    calls in flight to `MINIO__MAX_CONCURRENCY`; further callers wait for a
+    slot rather than piling work onto the executor queue.
+
+    The client and the bucket check are owned by a `MinioConnection`, which
+    caches whether the bucket exists. Presigning is done locally on the event
+    loop once the bucket has been checked.
+
     Attributes:
       session -- The underlying minio client session.
+      presign_cache -- The cache of presigned download urls.
 
     Methods:
-        delete(name) -- Deletes from the object store by name.
+        delete(names) -- Deletes from the object store by name.
 
-        list(prefix, recursive) -- Lists objects (by name) relative to a given
-            prefix. The `recursive` indicates whether we should list recursively
-            into sub-directories.
+        list(prefix, recursive, page_size) -- Lazily lists objects (by name)
+            relative to a given prefix, as an async generator. The `recursive`
+            indicates whether we should list recursively into sub-directories.
+            Objects are fetched from the store `page_size` at a time, as the
+            generator is consumed.
 
         put(name, data, size) -- Uploads `data` directly to the storage backend
             with filename `name`. `size` is an int representing the size of the
-            file.
+            file. Files larger than `MINIO__PART_SIZE` are streamed from `data`
+            as a multipart upload, holding at most `MINIO__PARALLEL_PARTS`
+            parts in memory.
+
+        scan(prefix, page_size) -- Lazily lists every object (recursively)
+            below `prefix` in lexicographic order of their names, yielding
+            pages of up to `page_size` objects. Only one page is held in
+            memory at a time.
 
-        presigned_get(name, expires) -- Returns a presigned url for fetching
-            `name` from the object store. The link will expire after a timedelta
-            `expires`, or by default (when `expires==None`) the value of the
-            `MINIO__DOWNLOAD_EXPIRE` environment variable (in seconds).
+        presigned_get(name, file_name, expires) -- Returns a presigned url for
+            fetching `name` from the object store, downloaded as `file_name`.
+            The link will expire after a timedelta `expires`, or by default
+            (when `expires==None`) the value of the `MINIO__DOWNLOAD_EXPIRE`
+            environment variable (in seconds). Default-expiry urls are cached
+            in `presign_cache` and reused while they remain valid for at least
+            `MINIO__PRESIGN_CACHE_MARGIN` seconds.
 
         presigned_put(name, expires) -- Returns a presigned url for putting
             an object on the store with name `name`. The link expires after a
             timedelta passed via `expires`, or by default it will expire after
             `MINIO__UPLOAD_EXPIRE` seconds.
+
+        create_multipart_upload(name) -- Starts a multipart upload of `name`,
+            returning its upload ID.
+
+        presigned_upload_part(name, upload_id, part_number, expires) --
+            Returns a presigned url for putting one part of a multipart upload.
+            Expires like `presigned_put`.
+
+        complete_multipart_upload(name, upload_id, parts) -- Assembles the
+            object from the uploaded parts, given as (part number, ETag) pairs.
+
+        abort_multipart_upload(name, upload_id) -- Discards a multipart upload
+            and its parts, if it still exists.
+
+        stat(name) -- Returns the object's metadata (fetched with a HEAD
+            request), or None if there is no such object.
+
+        start() -- Checks the bucket and starts background revalidation.
+
+        close() -- Stops revalidation and shuts down the executor once
+            in-flight calls complete.
+
+      All of the above are coroutines, except `list` and `scan`, which are
+      async generators.
     """
 
     def __init__(self, conf: MinioSettings | None = None) -> None:
         if not conf:
             conf = settings.minio
 
-        self._endpoint = conf.endpoint
-        self._access_key = conf.access_key
-        self._secret_key = conf.secret_key
         self._bucket = conf.bucket
         self._upload_expire = timedelta(seconds=conf.upload_expire)
         self._download_expire = timedelta(seconds=conf.download_expire)
+        self._part_size = conf.part_size
+        self._parallel_parts = conf.parallel_parts
+
+        self._executor = ThreadPoolExecutor(max_workers=conf.executor_workers, thread_name_prefix="minio")
+        self._semaphore = asyncio.Semaphore(conf.max_concurrency)
 
-        self._session = None
+        self._connection = MinioConnection(conf)
+
+        self.presign_cache: TTLCache[tuple[str, str | None], str] = TTLCache(maxsize=conf.presign_cache_size)
+        self._presign_cache_ttl = conf.download_expire - conf.presign_cache_margin
 
     @property
     def session(self) -> Minio:
-        """Retrieves the (or starts a) minio client session"""
-        if not self._session:
-            self._session = Minio(
-                endpoint=self._endpoint,
-                access_key=self._access_key,
-                secret_key=self._secret_key
-            )
+        """Retrieves the minio client session, checking the bucket on first use"""
+        if self._connection.bucket_exists is None:
+            self._connection.check()
 
-        if not self._session.bucket_exists(self._bucket):
+        if not self._connection.bucket_exists:
             raise BucketDoesNotExist(
                     "The specified bucket was not found on the Minio server.",
                     self._bucket)
 
-        return self._session
+        return self._connection.client
 
-    def delete(self, names: list[str]) -> None:
-        """Deletes stored objects"""
+    async def _run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a blocking call on the storage executor"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+            except (S3Error, HTTPError):
+                self._connection.invalidate()
+                raise
+
+    def _delete(self, names: list[str]) -> None:
         errors = list(self.session.remove_objects(self._bucket, [DeleteObject(name) for name in names]))
         if (n_errors:=len(errors)) > 0:
             raise FileDeleteError(f"{n_errors} file(s) could not be deleted.", self._bucket, list(map(lambda e: e.name, errors)), errors)
 
-    def list(self, prefix: str, recursive: bool = False) -> list[str]:
-        """Lists objects (by name) relative to a given prefix"""
-        return list(map(
-            lambda o: o.object_name[prefix.rfind("/")+1:],
-            self.session.list_objects(self._bucket, prefix, recursive=recursive)
-        ))
+    def _objects(self, prefix: str, recursive: bool = True) -> Iterator[Object]:
+        return self.session.list_objects(self._bucket, prefix, recursive=recursive)
 
-    def put(self, name: str, data, size) -> None:
-        """Uploads a file to Minio backend"""
+    def _next_page(self, objects: Iterator[Object], page_size: int) -> list[Object]:
+        return list(itertools.islice(objects, page_size))
+
+    def _put(self, name: str, data, size) -> None:
         try:
-            self.session.put_object(self._bucket, name, data, size)
+            self.session.put_object(
+                self._bucket,
+                name,
+                data,
+                size,
+                part_size=self._part_size,
+                num_parallel_uploads=self._parallel_parts
+            )
         except ValueError as e:
             raise FilePutError("Could not upload file to storage backend", self._bucket, name, e.args)
 
-    def presigned_get(self, object_name: str, file_name: str | None = None, expires: timedelta | None = None) -> str:
+    def _presigned_get(self, object_name: str, file_name: str | None, expires: timedelta) -> str:
+        response_headers = {}
+        if file_name is not None and file_name != object_name:
+            response_headers["response-content-disposition"] = f"attachment; filename=\"{file_name}\""
+
+        return self.session.presigned_get_object(self._bucket, object_name, expires, response_headers=response_headers)
+
+    def _presigned_put(self, name: str, expires: timedelta) -> str:
+        return self.session.presigned_put_object(self._bucket, name, expires)
+
+    def _presigned_upload_part(self, name: str, upload_id: str, part_number: int, expires: timedelta) -> str:
+        return self.session.get_presigned_url(
+            "PUT",
+            self._bucket,
+            name,
+            expires,
+            extra_query_params={"partNumber": str(part_number), "uploadId": upload_id}
+        )
+
+    def _create_multipart_upload(self, name: str) -> str:
+        return self.session._create_multipart_upload(self._bucket, name, {"Content-Type": "application/octet-stream"})
+
+    def _complete_multipart_upload(self, name: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+        self.session._complete_multipart_upload(
+            self._bucket,
+            name,
+            upload_id,
+            [Part(part_number, etag) for part_number, etag in sorted(parts)]
+        )
+
+    def _abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        try:
+            self.session._abort_multipart_upload(self._bucket, name, upload_id)
+        except S3Error as e:
+            if e.code != "NoSuchUpload":
+                raise
+
+    def _stat(self, name: str) -> Object | None:
+        try:
+            return self.session.stat_object(self._bucket, name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject", "ResourceNotFound"):
+                return None
+            raise
+
+    async def delete(self, names: list[str]) -> None:
+        """Deletes stored objects"""
+        if not names:
+            return
+        await self._run(self._delete, names)
+
+    async def list(self, prefix: str, recursive: bool = False, page_size: int = 1000) -> AsyncGenerator[str, None]:
+        """Lazily lists objects (by name) relative to a given prefix"""
+        start = prefix.rfind("/") + 1
+        async for page in self._pages(prefix, recursive, page_size):
+            for obj in page:
+                yield obj.object_name[start:]
+
+    async def _pages(self, prefix: str, recursive: bool, page_size: int) -> AsyncGenerator[List[Object], None]:
+        objects = await self._run(self._objects, prefix, recursive)
+        while page := await self._run(self._next_page, objects, page_size):
+            yield page
+
+    async def scan(self, prefix: str = "", page_size: int = 1000) -> AsyncGenerator[List[Object], None]:
+        """Lists objects below a prefix page by page, in order of their names"""
+        async for page in self._pages(prefix, True, page_size):
+            yield page
+
+    async def put(self, name: str, data, size) -> None:
+        """Uploads a file to Minio backend"""
+        await self._run(self._put, name, data, size)
+
+    async def presigned_get(self, object_name: str, file_name: str | None = None, expires: timedelta | None = None) -> str:
         """Creates a signed download url for the object"""
+        cacheable = not expires and self._presign_cache_ttl > 0
+        if cacheable and (url := self.presign_cache.get((object_name, file_name))) is not None:
+            return url
         if not expires:
             expires = self._download_expire
-        extra_query_params = {}
-        if file_name is not None and file_name != object_name:
-            extra_query_params["response-content-disposition"] = f"attachment; filename=\"{file_name}\""
 
-        return self.session.presigned_get_object(self._bucket, object_name, expires)
+        if self._connection.bucket_exists is None:
+            url = await self._run(self._presigned_get, object_name, file_name, expires)
+        else:
+            url = self._presigned_get(object_name, file_name, expires)
+
+        if cacheable:
+            self.presign_cache.set((object_name, file_name), url, ttl=self._presign_cache_ttl)
+        return url
 
-    def presigned_put(self, name: str, expires: timedelta | None = None) -> str:
+    async def presigned_put(self, name: str, expires: timedelta | None = None) -> str:
         """Creates a signed upload url for the object"""
         if not expires:
             expires = self._upload_expire
-        return self.session.presigned_put_object(self._bucket, name, expires)
+        if self._connection.bucket_exists is None:
+            return await self._run(self._presigned_put, name, expires)
+        return self._presigned_put(name, expires)
+
+    async def presigned_upload_part(self, name: str, upload_id: str, part_number: int, expires: timedelta | None = None) -> str:
+        """Creates a signed upload url for one part of a multipart upload"""
+        if not expires:
+            expires = self._upload_expire
+        if self._connection.bucket_exists is None:
+            return await self._run(self._presigned_upload_part, name, upload_id, part_number, expires)
+        return self._presigned_upload_part(name, upload_id, part_number, expires)
+
+    async def create_multipart_upload(self, name: str) -> str:
+        """Starts a multipart upload, returning its upload ID"""
+        return await self._run(self._create_multipart_upload, name)
+
+    # `list` is shadowed by the method above from here on
+    async def complete_multipart_upload(self, name: str, upload_id: str, parts: List[tuple[int, str]]) -> None:
+        """Assembles a multipart upload from its parts"""
+        await self._run(self._complete_multipart_upload, name, upload_id, parts)
+
+    async def abort_multipart_upload(self, name: str, upload_id: str) -> None:
+        """Discards a multipart upload"""
+        await self._run(self._abort_multipart_upload, name, upload_id)
+
+    async def stat(self, name: str) -> Object | None:
+        """Fetches an object's metadata"""
+        return await self._run(self._stat, name)
+
+    async def start(self) -> None:
+        """Checks the bucket and starts the background bucket revalidation"""
+        await self._connection.start(self._executor)
+
+    async def close(self) -> None:
+        """Stops bucket revalidation and shuts down the storage executor"""
+        await self._connection.stop()
+        self._executor.shutdown(wait=True)
 
 
 storage = MinioStorage()
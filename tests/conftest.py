@@ -0,0 +1,21 @@
+import os
+
+# The settings the application requires, for tests which need no database or
+# Minio server
+for name, value in {
+    "MINIO__ENDPOINT": "localhost:9000",
+    "MINIO__BUCKET": "fileshare",
+    "MINIO__ACCESS_KEY": "access",
+    "MINIO__SECRET_KEY": "secret",
+    "MINIO__UPLOAD_EXPIRE": "86400",
+    "MINIO__DOWNLOAD_EXPIRE": "60",
+    "DATABASE__PROTOCOL": "postgresql+asyncpg",
+    "DATABASE__HOSTNAME": "localhost",
+    "DATABASE__USERNAME": "fileshare",
+    "DATABASE__PASSWORD": "fileshare",
+    "DATABASE__DATABASE": "fileshare",
+    "DATABASE__PORT": "5432",
+    "GRAPHQL__DEFAULT_PAGE_SIZE": "10",
+    "GRAPHQL__PAGINATION_LIMIT": "100",
+}.items():
+    os.environ.setdefault(name, value)
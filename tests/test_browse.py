@@ -0,0 +1,85 @@
+import os
+import asyncio
+
+import pytest
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlakeyset.asyncio import select_page
+
+from fileshare.database.models import File
+from fileshare.graphql.cursors import CursorDecodeError, encode_cursor
+from fileshare.graphql.file.queries import browse_cursor_child, browse_query
+from fileshare.graphql.helpers import sort_spec
+
+NAMES = [
+    "a", "a.", "a/", "a/b", "a/b/c", "a/é", "a0", "a b/c", "ab", "ab/c", "ab/d/e",
+    "b/c", "é", "é/x", "z",
+]
+
+
+def children(prefix: str) -> list[tuple[str, int]]:
+    """Lists the children of `prefix` the slow way, in byte-wise order"""
+    counts: dict[str, int] = {}
+    for name in NAMES:
+        if name.startswith(prefix):
+            rest = name[len(prefix):]
+            child = rest[:rest.index("/") + 1] if "/" in rest else rest
+            counts[child] = counts.get(child, 0) + 1
+    return sorted(counts.items(), key=lambda item: item[0].encode("utf-8"))
+
+
+def test_cursor_child_round_trip():
+    spec = sort_spec(browse_query("a/"))
+    assert browse_cursor_child(encode_cursor(("b/",), spec), spec) == "b/"
+    assert browse_cursor_child(None, spec) is None
+
+def test_cursor_child_rejects_other_places():
+    spec = sort_spec(browse_query("a/"))
+    with pytest.raises(CursorDecodeError):
+        browse_cursor_child(encode_cursor(("b/", 1), spec), spec)
+
+
+async def _browse_pages(url: str, prefix: str, size: int) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+    """Pages through the children of `prefix` forwards, then backwards from the last one"""
+    engine = create_async_engine(url, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("CREATE SCHEMA test_browse"))
+            try:
+                await conn.execute(text("SET search_path TO test_browse"))
+                await conn.execute(CreateTable(File.__table__))
+                await conn.execute(CreateIndex(next(index for index in File.__table__.indexes if index.name == "idx_file_object_name_c")))
+                await conn.execute(insert(File), [{"object_name": name, "active": True} for name in NAMES])
+                session = AsyncSession(bind=conn)
+
+                forwards, place = [], None
+                while True:
+                    after = place[0] if place is not None else None
+                    page = await select_page(session, browse_query(prefix, after=after, limit=size + 1), per_page=size, after=place)
+                    forwards += [(child, file_count) for child, file_count, _ in page]
+                    if not page.paging.has_next:
+                        break
+                    place = page.paging.next.place
+
+                backwards, place = forwards[-1:], forwards[-1][:1] if forwards else None
+                while place is not None:
+                    page = await select_page(session, browse_query(prefix, before=place[0], limit=size + 1), per_page=size, before=place)
+                    backwards = [(child, file_count) for child, file_count, _ in page] + backwards
+                    if not page.paging.has_previous:
+                        break
+                    place = page.paging.previous.place
+                return forwards, backwards
+            finally:
+                await conn.rollback()
+    finally:
+        await engine.dispose()
+
+@pytest.mark.skipif("TEST_DATABASE_URL" not in os.environ, reason="needs a PostgreSQL database in TEST_DATABASE_URL")
+@pytest.mark.parametrize("prefix", ["", "a", "a/", "ab/", "é/", "zz"])
+@pytest.mark.parametrize("size", [1, 2, 5])
+def test_browse_pages_match_listing(prefix, size):
+    forwards, backwards = asyncio.run(_browse_pages(os.environ["TEST_DATABASE_URL"], prefix, size))
+    assert forwards == children(prefix)
+    assert backwards == children(prefix)
@@ -0,0 +1,59 @@
+import asyncio
+import gc
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from fileshare.settings import settings
+from fileshare.graphql.context import get_context, mark_written, reads_primary
+
+
+def _request() -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/gql", "headers": []})
+
+
+def test_outstanding_tasks_are_cancelled_with_the_request():
+    async def run():
+        loop = asyncio.get_running_loop()
+        unretrieved = []
+        loop.set_exception_handler(lambda loop, context: unretrieved.append(context))
+
+        async def fail():
+            raise RuntimeError("count failed")
+
+        contexts = get_context(_request())
+        context = await anext(contexts)
+        slow = asyncio.create_task(asyncio.sleep(60))
+        failed = asyncio.create_task(fail())
+        context["tasks"].update({slow, failed})
+        await asyncio.sleep(0)
+        await contexts.aclose()
+
+        assert slow.cancelled()
+        assert failed.done()
+        # A task whose exception was never retrieved reports it when collected
+        del failed
+        gc.collect()
+        return unretrieved
+
+    assert asyncio.run(run()) == []
+
+
+def test_mark_written_opens_the_read_your_writes_window(monkeypatch):
+    monkeypatch.setattr(settings.database, "read_your_writes", 5.0)
+    response = Response()
+    mark_written(response)
+    request = Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/gql",
+        "headers": [(b"cookie", response.headers["set-cookie"].split(";")[0].encode())],
+    })
+    assert reads_primary(request)
+
+
+def test_mark_written_is_a_no_op_without_a_window(monkeypatch):
+    monkeypatch.setattr(settings.database, "read_your_writes", 0.0)
+    response = Response()
+    mark_written(response)
+    assert "set-cookie" not in response.headers
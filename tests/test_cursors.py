@@ -0,0 +1,59 @@
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+import pytest
+
+from fileshare.graphql.cursors import CursorDecodeError, decode_cursor, encode_cursor
+
+SPEC = "file.updated DESC,file.created DESC,file.id DESC"
+
+
+def _raw(cursor: str) -> bytes:
+    return urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+
+def _cursor(raw: bytes) -> str:
+    return urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+@pytest.mark.parametrize("place", [
+    (datetime(2023, 7, 28, 1, 2, 3, 456789), datetime(1969, 12, 31, 23, 59, 59), uuid.uuid4()),
+    ("reports/2023/q2 – résumé.pdf", 0, -2**63, 2**63 - 1, uuid.uuid4()),
+    (1.5, float("-inf"), None, True, False, ""),
+    (),
+])
+def test_round_trip(place):
+    cursor = encode_cursor(place, SPEC)
+    assert decode_cursor(cursor, SPEC) == place
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(("a" * 100, uuid.uuid4()), SPEC)
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+
+def test_unsupported_value():
+    with pytest.raises(TypeError):
+        encode_cursor((object(),), SPEC)
+
+def test_sort_mismatch():
+    cursor = encode_cursor((datetime(2023, 7, 28), uuid.uuid4()), SPEC)
+    with pytest.raises(CursorDecodeError, match="different sort"):
+        decode_cursor(cursor, "file.created ASC,file.id ASC")
+
+@pytest.mark.parametrize("index", [0, 3, 10, -1])
+def test_tampered(index):
+    raw = bytearray(_raw(encode_cursor(("report.pdf", uuid.uuid4()), SPEC)))
+    raw[index] ^= 0x01
+    with pytest.raises(CursorDecodeError):
+        decode_cursor(_cursor(bytes(raw)), SPEC)
+
+def test_forged_place():
+    # A valid looking cursor whose values were swapped without re-signing
+    raw = _raw(encode_cursor((1,), SPEC))
+    forged = raw[:6] + (2).to_bytes(8, "big") + raw[-12:]
+    with pytest.raises(CursorDecodeError, match="signature"):
+        decode_cursor(_cursor(forged), SPEC)
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "AAAA", _cursor(b"\x01" * 8)])
+def test_malformed(cursor):
+    with pytest.raises(CursorDecodeError):
+        decode_cursor(cursor, SPEC)
@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from fileshare.database.models import File
+from fileshare.graphql.file.inputs import FileFilterInput, FileSortField, FileSortInput, SearchMode
+from fileshare.graphql.file.queries import apply_file_filters, apply_file_sort
+from fileshare.graphql.types import OrderDirection
+
+
+def _sql(mode: SearchMode) -> str:
+    filters = FileFilterInput(search="quarterly rep", search_mode=mode)
+    q = apply_file_filters(select(File), filters)
+    q = apply_file_sort(q, FileSortInput(direction=OrderDirection.DESC, field=FileSortField.RELEVANCE), filters)
+    return str(q.compile(dialect=postgresql.asyncpg.dialect()))
+
+
+@pytest.mark.parametrize("mode, function", [(SearchMode.PREFIX, "to_tsquery"), (SearchMode.WORDS, "plainto_tsquery")])
+def test_search_config_is_regconfig(mode, function):
+    # A config passed as a plain string is sent as varchar, for which there is no to_tsquery
+    sql = _sql(mode)
+    tsquery = f"{function}(CAST($1::VARCHAR AS REGCONFIG), $2::VARCHAR)"
+    assert f"file.tsvector @@ {tsquery}" in sql
+    assert f"ORDER BY ts_rank(file.tsvector, {function}(CAST($3::VARCHAR AS REGCONFIG), $4::VARCHAR)) DESC" in sql
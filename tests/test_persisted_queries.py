@@ -0,0 +1,77 @@
+import json
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fileshare.graphql.persisted import query_hash
+from fileshare.graphql.schema import graphql_app
+from fileshare.instrumentation import router as stats_router
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(graphql_app, prefix="/gql")
+    return TestClient(app)
+
+@pytest.fixture
+def query():
+    # Unique per test, so no hash is known from an earlier test
+    return f"query Typename{uuid.uuid4().hex} {{ __typename }}"
+
+def persisted(query: str) -> dict:
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+
+
+def test_unknown_hash(client, query):
+    response = client.post("/gql", json={"extensions": persisted(query)})
+    assert response.status_code == 200
+    assert response.json()["errors"][0]["message"] == "PersistedQueryNotFound"
+    assert response.json()["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+
+def test_register_and_replay(client, query):
+    response = client.post("/gql", json={"extensions": persisted(query)})
+    assert response.json()["errors"][0]["message"] == "PersistedQueryNotFound"
+
+    response = client.post("/gql", json={"query": query, "extensions": persisted(query)})
+    assert response.json()["data"] == {"__typename": "Query"}
+
+    response = client.post("/gql", json={"extensions": persisted(query)})
+    assert response.json()["data"] == {"__typename": "Query"}
+
+    response = client.get("/gql", params={"extensions": json.dumps(persisted(query))})
+    assert response.json()["data"] == {"__typename": "Query"}
+
+def test_mismatched_hash_not_registered(client, query):
+    other = f"query Other{uuid.uuid4().hex} {{ __typename }}"
+    response = client.post("/gql", json={"query": query, "extensions": persisted(other)})
+    assert response.json()["data"] == {"__typename": "Query"}
+
+    response = client.post("/gql", json={"extensions": persisted(other)})
+    assert response.json()["errors"][0]["message"] == "PersistedQueryNotFound"
+
+def test_cached_validation_errors(client):
+    query = f"query Invalid{uuid.uuid4().hex} {{ noSuchField }}"
+    first = client.post("/gql", json={"query": query}).json()
+    second = client.post("/gql", json={"query": query}).json()
+    assert first["errors"][0]["message"] == second["errors"][0]["message"]
+    assert "noSuchField" in first["errors"][0]["message"]
+
+def test_stats_count_hits_and_misses(client, query):
+    app = FastAPI()
+    app.include_router(stats_router)
+    stats = TestClient(app)
+
+    before = stats.get("/stats").json()["graphql"]
+    client.post("/gql", json={"extensions": persisted(query)})
+    client.post("/gql", json={"query": query, "extensions": persisted(query)})
+    client.post("/gql", json={"extensions": persisted(query)})
+    after = stats.get("/stats").json()["graphql"]
+
+    assert after["persisted_queries"]["misses"] - before["persisted_queries"]["misses"] == 1
+    assert after["persisted_queries"]["hits"] - before["persisted_queries"]["hits"] == 1
+    # The query is parsed once, and its document reused for the replay
+    assert after["documents"]["hits"] - before["documents"]["hits"] >= 1
+    assert after["documents"]["size"] >= 1
@@ -0,0 +1,27 @@
+import pytest
+from graphql import parse
+
+from fileshare.graphql.extensions import QueryCost
+from fileshare.graphql.schema import schema
+from fileshare.settings import settings
+
+
+def _cost(query: str, variables: dict | None = None) -> int:
+    graphql_schema = schema._schema
+    operation = parse(query).definitions[0]
+    cost = QueryCost(graphql_schema, {}, variables, settings.graphql)
+    cost.visit(graphql_schema.query_type, operation.selection_set, 1, 0)
+    return cost.cost
+
+FILES = "query($first: Int) {{ files({argument}) {{ ... on FileTypeCountableConnection {{ edges {{ node {{ id shares {{ id }} }} }} }} }} }}"
+
+
+@pytest.mark.parametrize("argument", ["first: 0", "last: 0", "first: $first"])
+def test_explicit_zero_page_size(argument):
+    default = _cost(FILES.format(argument="first: $first"))
+    assert _cost(FILES.format(argument=argument), {"first": 0}) < default
+
+def test_page_size_scales_cost():
+    one = _cost(FILES.format(argument="first: 1"))
+    assert _cost(FILES.format(argument="first: 2")) > one
+    assert _cost(FILES.format(argument="first: $first")) == _cost(FILES.format(argument=f"first: {settings.graphql.default_page_size}"))
@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+from fileshare.graphql.share.cache import ShareCache
+from fileshare.graphql.share.types import ShareType
+from fileshare.invalidation import MemoryInvalidationBus
+
+
+def _share(key: str = "key") -> ShareType:
+    now = datetime.now()
+    return ShareType(
+        id=uuid.uuid4(), file_id=uuid.uuid4(), created=now, updated=now,
+        key=key, expiry=None, download_limit=0, download_count=0
+    )
+
+
+def test_set_and_get():
+    cache = ShareCache(MemoryInvalidationBus())
+    share = _share()
+    cache.set(share, cache.generation)
+    assert cache.get(id=share.id) is share
+    assert cache.get(key=share.key) is share
+    assert cache.get(id=share.id, key="other") is None
+
+def test_invalidation_during_read_is_not_cached():
+    cache = ShareCache(MemoryInvalidationBus())
+    share = _share()
+    # A read takes the generation, an edit of the share commits and
+    # invalidates it, and then the read finishes with the old row
+    generation = cache.generation
+    asyncio.run(cache.invalidate(ids=[share.id]))
+    cache.set(share, generation)
+    assert cache.get(id=share.id) is None
+    assert cache.get(key=share.key) is None
+
+def test_invalidation_drops_cached_share():
+    cache = ShareCache(MemoryInvalidationBus())
+    share = _share()
+    cache.set(share, cache.generation)
+    asyncio.run(cache.invalidate(file_ids=[share.file_id]))
+    assert cache.get(id=share.id) is None
@@ -0,0 +1,56 @@
+import asyncio
+import uuid
+
+from sqlalchemy.dialects import postgresql
+
+from fileshare.database.models import Share
+from fileshare.graphql.share.inputs import EditShareInput
+from fileshare.graphql.share.mutations import EDIT_BATCH_SIZE, apply_share_edits
+
+
+class RecordingSession:
+    """Compiles the executed statements instead of running them"""
+
+    def __init__(self):
+        self.compiled = []
+
+    async def execute(self, statement):
+        self.compiled.append(statement.compile(dialect=postgresql.asyncpg.dialect()))
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+def _edit(**fields) -> EditShareInput:
+    return EditShareInput(**{"id": None, "key": None, "new_expiry": None, "new_download_limit": None, "new_key": None, **fields})
+
+def _apply(selector, edits) -> list:
+    session = RecordingSession()
+    asyncio.run(apply_share_edits(session, selector, edits))
+    return session.compiled
+
+
+def test_values_are_cast():
+    # A VALUES column of NULLs only would otherwise be typed as text, which COALESCE rejects
+    compiled, = _apply(Share.id, [_edit(id=uuid.uuid4(), new_key="key")])
+    sql = str(compiled)
+    assert "CAST($1::UUID AS UUID)" in sql
+    assert "CAST($2::TIMESTAMP WITHOUT TIME ZONE AS TIMESTAMP WITHOUT TIME ZONE)" in sql
+    assert "CAST($3::INTEGER AS INTEGER)" in sql
+    assert "CAST($4::VARCHAR AS VARCHAR)" in sql
+
+def test_edits_are_batched():
+    ids = [uuid.uuid4() for _ in range(2 * EDIT_BATCH_SIZE + 1)]
+    compiled = _apply(Share.id, [_edit(id=id, new_download_limit=1) for id in ids])
+    assert len(compiled) == 3
+    assert all(len(c.params) <= 4 * EDIT_BATCH_SIZE for c in compiled)
+    # Every batch updates its own shares
+    selected = [value for c in compiled for value in c.params.values() if isinstance(value, uuid.UUID)]
+    assert selected == ids
+
+def test_no_edits():
+    assert _apply(Share.key, []) == []
@@ -0,0 +1,83 @@
+import os
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import Index, Table, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from fileshare.database.models import File, Share
+from fileshare.graphql.file.inputs import FileSortField, FileSortInput
+from fileshare.graphql.helpers import Explain
+from fileshare.graphql.share.inputs import ShareSortField, ShareSortInput
+from fileshare.graphql.types import OrderDirection
+
+# Sorts by a computed column, which no index can serve
+UNINDEXED = {FileSortField.RELEVANCE}
+
+SORTS = [
+    (File, FileSortInput, field) for field in FileSortField if field not in UNINDEXED
+] + [
+    (Share, ShareSortInput, field) for field in ShareSortField
+]
+
+
+def matching_index(table: Table, columns: list[str]) -> Index | None:
+    """Returns the plain b-tree index on exactly `columns`, in order"""
+    for index in table.indexes:
+        if [getattr(column, "name", None) for column in index.expressions] == columns and not index.dialect_options["postgresql"]["using"]:
+            return index
+    return None
+
+
+@pytest.mark.parametrize("field", [*FileSortField, *ShareSortField], ids=str)
+def test_sort_ends_with_id(field):
+    assert field.value[-1] == "id"
+    assert "id" not in field.value[:-1]
+
+@pytest.mark.parametrize("model, sort_input, field", SORTS, ids=lambda value: str(value) if not isinstance(value, type) else "")
+def test_sort_has_index(model, sort_input, field):
+    assert matching_index(model.__table__, field.value) is not None
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+async def _explain_sorts(url: str) -> list[tuple[str, str, list[dict]]]:
+    engine = create_async_engine(url, poolclass=NullPool)
+    plans = []
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("CREATE SCHEMA test_sort_indexes"))
+            try:
+                await conn.execute(text("SET search_path TO test_sort_indexes"))
+                for model in (File, Share):
+                    await conn.execute(CreateTable(model.__table__, include_foreign_key_constraints=[]))
+                for model, _, field in SORTS:
+                    await conn.execute(CreateIndex(matching_index(model.__table__, field.value)))
+                # Without statistics on empty tables the planner would choose
+                # a scan and sort only because it is cheaper on so few rows
+                await conn.execute(text("SET enable_seqscan = off"))
+                for model, sort_input, field in SORTS:
+                    index = matching_index(model.__table__, field.value)
+                    for direction in OrderDirection:
+                        query = select(model).order_by(*sort_input(direction=direction, field=field).items).limit(10)
+                        plan = (await conn.execute(Explain(query))).scalar()
+                        if isinstance(plan, str):
+                            plan = json.loads(plan)
+                        plans.append((index.name, f"{field} {direction}", list(_plan_nodes(plan[0]["Plan"]))))
+            finally:
+                await conn.rollback()
+    finally:
+        await engine.dispose()
+    return plans
+
+@pytest.mark.skipif("TEST_DATABASE_URL" not in os.environ, reason="needs a PostgreSQL database in TEST_DATABASE_URL")
+def test_sorts_use_their_index():
+    for index_name, sort, nodes in asyncio.run(_explain_sorts(os.environ["TEST_DATABASE_URL"])):
+        assert not any(node["Node Type"] == "Sort" for node in nodes), sort
+        assert any(node.get("Index Name") == index_name for node in nodes), sort